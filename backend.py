@@ -1,24 +1,126 @@
+import io
+import sys
+import argparse
+import hashlib
 import os
 import random
 import json
 import time
+import heapq
+import bisect
+import zlib
+import re
+import calendar
+import threading
+import asyncio
+import queue
+import concurrent.futures
+import contextlib
+import contextvars
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
 from typing import Dict, Any, List
+import numpy as np
 import modal
-from flask import Flask, request, jsonify
+from collections.abc import Mapping
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from openai import OpenAI
+from fastapi import FastAPI, Request as ASGIRequest
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response as ASGIResponse, StreamingResponse
+from openai import OpenAI, AsyncOpenAI
+
+# Optional fast native JSON encoder; the stdlib json module is used without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional columnar export (python backend.py export); only needed for analytics exports
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 # --- MODAL CONFIGURATION ---
 app = modal.App("lumincredit-backend")
 
 image = (
     modal.Image.debian_slim()
-    .pip_install("flask", "flask-cors", "openai")
+    .pip_install("flask", "flask-cors", "openai", "numpy", "fastapi[standard]", "orjson")
     .add_local_dir("backend", remote_path="/root/backend")
 )
 
+# --- SERIALIZATION ---
+
+def _json_default(obj):
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def json_dumps(obj) -> bytes:
+    """Compact JSON as UTF-8 bytes, via orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_json_default)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=_json_default).encode("utf-8")
+
+def json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Routes Flask's jsonify/request.json through json_dumps/json_loads."""
+    def dumps(self, obj, **kwargs):
+        return json_dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return json_loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(json_dumps(obj), mimetype=self.mimetype)
+
+class EncodedSectionCache:
+    """
+    Pre-encoded JSON bytes of response sections, reused for as long as the
+    fingerprint of their source (user version, materialized core) is unchanged.
+    """
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encode(self, key, fingerprint, value):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(key)
+                return entry[1]
+        encoded = json_dumps(value)
+        with self._lock:
+            self._entries[key] = (fingerprint, encoded)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return encoded
+
+def encode_object(fields):
+    """Splices (key, encoded value bytes) pairs into one JSON object."""
+    return b"{" + b",".join(json_dumps(key) + b":" + value for key, value in fields) + b"}"
+
+ENCODED_SECTIONS = EncodedSectionCache()
+
 # --- FLASK APP SETUP ---
 web_app = Flask(__name__)
+web_app.json = FastJSONProvider(web_app)
 CORS(web_app)
 
 # --- CONFIGURATION ---
@@ -26,27 +128,117 @@ CORS(web_app)
 if not os.environ.get("NEBIUS_API_KEY"):
     os.environ["NEBIUS_API_KEY"] = "v1.CmQKHHN0YXRpY2tleS1lMDBtcHZ6eTcxdDF3OTd6ZXASIXNlcnZpY2VhY2NvdW50LWUwMGsxaGRhM3RzMDZ3Zng5YTIMCMCpp8kGEPz028sBOgwIvqy_lAcQgLPt0AFAAloDZTAw.AAAAAAAAAAH0GoQ48XrPcBJFtUWANylhCsf7lMwELApUZMYkTmAQn4L-dgWV4vQuU-yNXi7Tp_s08qLaRsUnxi0RqUBSxFoL"
 
+# --- USER SNAPSHOTS ---
+# Users are stored as immutable snapshots, one per version. Readers get a
+# frozen view they can use without locks or copies; writers build the next
+# version from a draft, sharing every unchanged transaction with the old one.
+
+class FrozenDict(dict):
+    """A dict that refuses mutation. `copy()` returns a plain, mutable dict."""
+    __slots__ = ()
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError(f"{type(self).__name__} is immutable")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = _immutable
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+def freeze(value):
+    """Deep-freezes plain JSON values; already frozen values (FrozenDicts, tuples) are shared as is."""
+    if isinstance(value, (FrozenDict, tuple, str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+class UserSnapshot(FrozenDict):
+    """
+    One version of a user. Fields are deep-frozen; derived views computed
+    for a version (annotations, indexes) are memoized on the snapshot and
+    never written into the fields, so they cannot reach persisted data.
+    """
+    __slots__ = ("version", "_derived")
+
+    def __init__(self, fields, version=0):
+        dict.__init__(self, ((k, freeze(v)) for k, v in fields.items()))
+        self.version = version
+        self._derived = {}
+
+    def __reduce__(self):
+        return (UserSnapshot, (dict(self), self.version))
+
+    def draft(self):
+        """A mutable copy for building the next version. Transactions become a list sharing the frozen entries."""
+        draft = dict(self)
+        draft['transactions'] = list(self.get('transactions', ()))
+        return draft
+
+    def overlay(self, **fields):
+        """A request-local view of this version with extra fields; not stored."""
+        return UserSnapshot({**self, **fields}, self.version)
+
+    def derived(self, key, compute):
+        """Memoizes compute(self) for this version."""
+        if key not in self._derived:
+            self._derived[key] = compute(self)
+        return self._derived[key]
+
+# Derived fields, listed in dependency order: (field, input fields, compute(user)).
+# A field is recomputed only when one of its inputs changes.
+DERIVED_FIELDS = (
+    # Simulated tax statement: approx 30% of income
+    ("last_year_tax_paid", ("income",), lambda u: int(u.get('income', 0) * 0.3)),
+    # Requirement: "est income also based on last year tax statment"
+    ("estimated_income", ("last_year_tax_paid",),
+     lambda u: int(u['last_year_tax_paid'] / 0.3) if u['last_year_tax_paid'] > 0 else 0),
+    ("utilization", ("current_balance", "credit_limit"),
+     lambda u: round(u.get('current_balance', 0) / u['credit_limit'], 4) if u.get('credit_limit') else u.get('utilization', 0)),
+    # payment_history is 0-100 (as derived in map_data.py): -10 per missed payment
+    ("payment_history", ("num_missed_payments_12m",),
+     lambda u: max(0, 100 - 10 * u.get('num_missed_payments_12m', 0))),
+    # The stored score (default impacts), read by /chat context and goal planning
+    ("score", ("payment_history", "utilization", "transactions"),
+     lambda u: CreditCalculationAgent.calculate(u))
+)
+DERIVATION_INPUTS = {field for _, inputs, _ in DERIVED_FIELDS for field in inputs}
+
+def derive_fields(user, changed):
+    """
+    Recomputes, in place, the derived fields downstream of the `changed`
+    input fields. Returns the set of fields that changed, inputs included.
+    """
+    changed = set(changed)
+    for field, inputs, compute in DERIVED_FIELDS:
+        if changed.isdisjoint(inputs):
+            continue
+        value = compute(user)
+        if user.get(field) != value:
+            user[field] = value
+            changed.add(field)
+    return changed
+
 # --- DATA LOADING ---
 USER_DATA = {}
 
 def load_user_data():
     global USER_DATA
     try:
-        with open('backend/user_data.json', 'r') as f:
-            users = json.load(f)
+        with open('backend/user_data.json', 'rb') as f:
+            users = json_loads(f.read())
             for user in users:
-                # Simulate Tax Statement Data
+                # Simulate Tax Statement Data from income
                 # In a real scenario, this would come from a document or separate file
-                user['last_year_tax_paid'] = int(user.get('income', 0) * 0.3) # Approx 30% tax
-                
-                # Estimate Income based on Tax Statement
-                # Requirement: "est income also based on last year tax statment"
-                if user['last_year_tax_paid'] > 0:
-                    user['estimated_income'] = int(user['last_year_tax_paid'] / 0.3)
-                else:
-                    user['estimated_income'] = 0
+                derive_fields(user, {"income"})
+
+                # Alert flags are derived per response; drop any that were persisted
+                for tx in user.get('transactions', []):
+                    tx.pop('alert', None)
                     
-                USER_DATA[user['username']] = user
+                USER_DATA[user['username']] = UserSnapshot(user)
         print(f"Loaded {len(USER_DATA)} users.")
     except FileNotFoundError:
         print("Error: backend/user_data.json not found. Run map_data.py first.")
@@ -57,8 +249,12 @@ def save_user_data():
     try:
         # Convert USER_DATA values back to list
         users_list = list(USER_DATA.values())
-        with open('backend/user_data.json', 'w') as f:
-            json.dump(users_list, f, indent=4)
+        # Compact encoding; written to a temp file and swapped in so readers never see a partial file
+        encoded = json_dumps(users_list)
+        tmp_path = f"backend/user_data.json.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(encoded)
+        os.replace(tmp_path, 'backend/user_data.json')
         print("User data saved.")
     except Exception as e:
         print(f"Error saving user data: {e}")
@@ -69,6 +265,419 @@ load_user_data()
 def get_user_by_username(username: str) -> Dict[str, Any]:
     return USER_DATA.get(username)
 
+# --- USER VERSIONS ---
+# Every mutation of a user commits a new snapshot with the next version, so
+# precomputed results can tell whether they were derived from the current state.
+_user_write_lock = threading.Lock()
+
+def get_user_version(username: str) -> int:
+    user = USER_DATA.get(username)
+    return user.version if user is not None else 0
+
+def update_user(username: str, mutate, before_commit=None) -> UserSnapshot:
+    """
+    Commits the next version of a user: `mutate` edits a draft of the
+    current snapshot in place, then derived fields whose inputs changed are
+    recomputed. `before_commit(snapshot)` runs under the write lock just
+    before the new version becomes visible, for per-user indexes that must
+    never lag behind it. Returns the new snapshot, or None if the user does
+    not exist. Readers holding the old snapshot are unaffected.
+    """
+    with _user_write_lock:
+        current = USER_DATA.get(username)
+        if current is None:
+            return None
+        draft = current.draft()
+        mutate(draft)
+        # Keep sharing the transaction tuple when the writer left it unchanged
+        # (done first, so unchanged transactions do not count as a changed input)
+        transactions = current.get('transactions', ())
+        if len(draft['transactions']) == len(transactions) and all(a is b for a, b in zip(draft['transactions'], transactions)):
+            draft['transactions'] = transactions
+        derive_fields(draft, {field for field in DERIVATION_INPUTS if draft.get(field) != current.get(field)})
+        updated = UserSnapshot(draft, current.version + 1)
+        if before_commit is not None:
+            before_commit(updated)
+        USER_DATA[username] = updated
+        # Published under the write lock so subscribers see versions in commit order
+        CHANGE_FEED.publish(username, updated.version, "change", user_changes(current, updated), after_version=current.version)
+    return updated
+
+def ensure_score(user):
+    """
+    The user with a 'score' field. Stored users keep it current as a derived
+    field; it is computed as a request-local overlay only when missing.
+    """
+    if 'score' in user:
+        return user
+    return user.overlay(score=CreditCalculationAgent.calculate(user))
+
+# --- LLM CLIENT ---
+
+NEBIUS_BASE_URL = "https://api.tokenfactory.nebius.com/v1/"
+NEBIUS_MODEL = "meta-llama/Llama-3.3-70B-Instruct-fast"
+
+class LLMCall:
+    """
+    One agent request to Nebius, independent of how it is sent.
+    `messages` and `params` describe the completion, `parse` turns the reply
+    into the agent's result and `fallback` produces it when the call fails.
+    Agents that can answer without the LLM set `result` instead. `username`
+    is who the call is for, used to share LLM capacity fairly between users.
+    """
+    def __init__(self, agent, messages=None, parse=None, fallback=None, result=None, username=None, **params):
+        self.agent = agent
+        self.username = username
+        self.messages = messages
+        self.parse = parse
+        self.fallback = fallback
+        self.result = result
+        self.params = params
+
+def nebius_client():
+    return OpenAI(base_url=NEBIUS_BASE_URL, api_key=os.environ.get("NEBIUS_API_KEY"))
+
+_nebius_async_client = None
+
+def nebius_async_client():
+    # Shared so concurrent requests reuse one connection pool
+    global _nebius_async_client
+    if _nebius_async_client is None:
+        _nebius_async_client = AsyncOpenAI(base_url=NEBIUS_BASE_URL, api_key=os.environ.get("NEBIUS_API_KEY"))
+    return _nebius_async_client
+
+# Priority classes, most urgent first. Agents map to a class by name; work
+# running inside llm_priority(...) (e.g. background precompute) overrides it.
+LLM_PRIORITY_CLASSES = ("payment", "chat", "dashboard", "background")
+AGENT_PRIORITIES = {"Payment": "payment", "Chat": "chat"}
+# Share of the concurrency limit background work may hold, so it never fills every slot
+LLM_BACKGROUND_SHARE = 0.25
+LLM_QUEUE_TIMEOUT = {"payment": 20.0, "chat": 30.0, "dashboard": 60.0, "background": 600.0}
+# Completion tokens assumed for calls that do not set max_tokens
+LLM_DEFAULT_COMPLETION_TOKENS = 400
+
+class LLMPriorityScope:
+    """
+    The priority of a block of work and the tickets it has queued. Mutable so
+    the work can be promoted while it runs (see LLMScheduler.promote).
+    """
+    def __init__(self, priority):
+        self.priority = priority
+        self.tickets = []
+
+_llm_priority = contextvars.ContextVar("llm_priority", default=None)
+
+@contextlib.contextmanager
+def llm_priority(priority):
+    """Runs the enclosed LLM calls (including ones made by coalesced work) in `priority`."""
+    token = _llm_priority.set(LLMPriorityScope(priority))
+    try:
+        yield
+    finally:
+        _llm_priority.reset(token)
+
+def current_llm_priority(default="dashboard"):
+    scope = _llm_priority.get()
+    return scope.priority if scope is not None else default
+
+class _LLMTicket:
+    __slots__ = ("priority", "username", "cost", "scope", "enqueued", "granted_at", "state", "_event", "_loop", "_future")
+
+    def __init__(self, priority, username, cost, scope=None):
+        self.priority = priority
+        self.username = username
+        self.cost = cost
+        self.scope = scope
+        self.enqueued = time.monotonic()
+        self.granted_at = None
+        self.state = "waiting"
+        self._event = None
+        self._loop = None
+        self._future = None
+
+    def grant(self):
+        self.state = "granted"
+        self.granted_at = time.monotonic()
+        if self._future is not None:
+            self._loop.call_soon_threadsafe(lambda: self._future.done() or self._future.set_result(True))
+        else:
+            self._event.set()
+
+class LLMScheduler:
+    """
+    Central admission for every Nebius call.
+    - Strict priority between classes (payment > chat > dashboard > background).
+    - Weighted fair queuing between users inside a class: each call gets a
+      virtual finish tag of max(class clock, user's last tag) + estimated
+      tokens, and the smallest tag goes next, so one heavy user cannot
+      starve the others.
+    - A global concurrency limit and a tokens-per-minute bucket, both cut
+      back when Nebius answers 429 and grown again on successes (AIMD).
+    Calls wait for a slot in the priority's queue up to LLM_QUEUE_TIMEOUT and
+    raise TimeoutError after that, which the agents turn into their fallback.
+    Work running in an llm_priority scope can be promoted to a more urgent
+    class while queued, e.g. when an interactive request joins it.
+    """
+    def __init__(self, max_concurrency=64, tokens_per_minute=400000, min_concurrency=1, min_tokens_per_minute=10000):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency_limit = float(max_concurrency)
+        self.max_tpm = tokens_per_minute
+        self.min_tpm = min_tokens_per_minute
+        self.tpm = float(tokens_per_minute)
+        self._tokens = float(tokens_per_minute) / 6
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._queues = {p: [] for p in LLM_PRIORITY_CLASSES}
+        self._clock = {p: 0.0 for p in LLM_PRIORITY_CLASSES}
+        self._last_tag = {p: {} for p in LLM_PRIORITY_CLASSES}
+        self._in_flight = {p: 0 for p in LLM_PRIORITY_CLASSES}
+        self._stats = {p: {"dispatched": 0, "timeouts": 0, "wait_total": 0.0, "wait_max": 0.0, "waits": deque(maxlen=500)}
+                       for p in LLM_PRIORITY_CLASSES}
+        self.throttled = 0
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    @staticmethod
+    def estimate_cost(call):
+        prompt = sum(estimate_tokens(m.get('content') or "") for m in call.messages)
+        return prompt + call.params.get('max_tokens', LLM_DEFAULT_COMPLETION_TOKENS)
+
+    def _ticket(self, call):
+        scope = _llm_priority.get()
+        priority = scope.priority if scope is not None else AGENT_PRIORITIES.get(call.agent, "dashboard")
+        return _LLMTicket(priority, call.username, self.estimate_cost(call), scope)
+
+    def _push(self, ticket):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch_loop, name="llm-scheduler", daemon=True)
+                self._thread.start()
+            if ticket.scope is not None:
+                # Read under the lock so a concurrent promote() cannot be missed
+                ticket.priority = ticket.scope.priority
+                ticket.scope.tickets = [t for t in ticket.scope.tickets if t.state == "waiting"] + [ticket]
+            self._enqueue(ticket)
+            self._cond.notify_all()
+
+    def _enqueue(self, ticket):
+        user_tags = self._last_tag[ticket.priority]
+        tag = max(self._clock[ticket.priority], user_tags.get(ticket.username, 0.0)) + ticket.cost
+        user_tags[ticket.username] = tag
+        self._seq += 1
+        heapq.heappush(self._queues[ticket.priority], (tag, self._seq, ticket))
+
+    def promote(self, scope, priority):
+        """
+        Raises `scope` to `priority` if that is more urgent: its queued tickets
+        move to the new class and its later calls are made there. Granted
+        calls keep their class, so in-flight accounting stays consistent.
+        """
+        rank = LLM_PRIORITY_CLASSES.index
+        with self._cond:
+            if rank(priority) >= rank(scope.priority):
+                return
+            scope.priority = priority
+            for ticket in scope.tickets:
+                if ticket.state == "waiting":
+                    # The old heap entry is skipped once the ticket's class changes
+                    ticket.priority = priority
+                    self._enqueue(ticket)
+            scope.tickets = [t for t in scope.tickets if t.state == "waiting"]
+            self._cond.notify_all()
+
+    def acquire(self, call):
+        """Blocks until the call may be sent. Returns the ticket to release()."""
+        ticket = self._ticket(call)
+        ticket._event = threading.Event()
+        self._push(ticket)
+        if not ticket._event.wait(LLM_QUEUE_TIMEOUT[ticket.priority]):
+            self._abandon(ticket)
+        return ticket
+
+    async def acquire_async(self, call):
+        ticket = self._ticket(call)
+        ticket._loop = asyncio.get_running_loop()
+        ticket._future = ticket._loop.create_future()
+        self._push(ticket)
+        try:
+            await asyncio.wait_for(ticket._future, LLM_QUEUE_TIMEOUT[ticket.priority])
+        except asyncio.TimeoutError:
+            self._abandon(ticket)
+        except BaseException:
+            # The waiting task was cancelled (e.g. the client went away): never leave a slot behind
+            self._withdraw(ticket)
+            raise
+        return ticket
+
+    def _abandon(self, ticket):
+        with self._cond:
+            if ticket.state == "granted":
+                return
+            ticket.state = "cancelled"
+            self._stats[ticket.priority]["timeouts"] += 1
+        raise TimeoutError(f"No LLM capacity for {ticket.priority} call within {LLM_QUEUE_TIMEOUT[ticket.priority]}s")
+
+    def _withdraw(self, ticket):
+        """Drops a ticket whose caller gave up: dequeued if still waiting, released if already granted."""
+        with self._cond:
+            if ticket.state != "granted":
+                ticket.state = "cancelled"
+                return
+        self.release(ticket)
+
+    def release(self, ticket, rate_limited=False, retry_after=None):
+        with self._cond:
+            self._in_flight[ticket.priority] -= 1
+            if rate_limited:
+                # Multiplicative decrease, and pause dispatching for a moment
+                self.throttled += 1
+                self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+                self.tpm = max(self.min_tpm, self.tpm * 0.7)
+                self._paused_until = max(self._paused_until, time.monotonic() + (retry_after or 1.0))
+            else:
+                # Additive increase: about +1 slot per limit's worth of successes
+                self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1.0 / self.concurrency_limit)
+                self.tpm = min(self.max_tpm, self.tpm + self.max_tpm * 0.01)
+            self._cond.notify_all()
+
+    def _refill(self, now):
+        capacity = self.tpm / 6
+        self._tokens = min(capacity, self._tokens + (now - self._refilled) * self.tpm / 60.0)
+        self._refilled = now
+
+    def _next_ticket(self):
+        """The next grantable ticket, or (None, seconds to wait)."""
+        in_flight = sum(self._in_flight.values())
+        if in_flight >= int(self.concurrency_limit):
+            return None, None
+        for priority in LLM_PRIORITY_CLASSES:
+            queue_ = self._queues[priority]
+            while queue_ and (queue_[0][2].state == "cancelled" or queue_[0][2].priority != priority):
+                heapq.heappop(queue_)
+            if not queue_:
+                continue
+            if priority == "background" and self._in_flight[priority] >= max(1, int(self.concurrency_limit * LLM_BACKGROUND_SHARE)):
+                return None, None
+            ticket = queue_[0][2]
+            # Large calls may take the bucket to at most its capacity
+            cost = min(ticket.cost, self.tpm / 6)
+            if self._tokens < cost:
+                return None, (cost - self._tokens) * 60.0 / self.tpm
+            tag, _, _ = heapq.heappop(queue_)
+            self._tokens -= cost
+            self._clock[priority] = tag
+            return ticket, None
+        return None, None
+
+    def _dispatch_loop(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    self._cond.wait(self._paused_until - now)
+                    continue
+                self._refill(now)
+                ticket, wait = self._next_ticket()
+                if ticket is None:
+                    self._cond.wait(wait)
+                    continue
+                self._in_flight[ticket.priority] += 1
+                stats = self._stats[ticket.priority]
+                waited = now - ticket.enqueued
+                stats["dispatched"] += 1
+                stats["wait_total"] += waited
+                stats["wait_max"] = max(stats["wait_max"], waited)
+                stats["waits"].append(waited)
+                ticket.grant()
+                self._prune(ticket.priority)
+
+    def _prune(self, priority):
+        # Tags at or below the class clock no longer affect ordering
+        tags = self._last_tag[priority]
+        if len(tags) > 10000:
+            clock = self._clock[priority]
+            for username in [u for u, t in tags.items() if t <= clock]:
+                del tags[username]
+
+    def metrics(self):
+        with self._cond:
+            classes = {}
+            for priority in LLM_PRIORITY_CLASSES:
+                stats = self._stats[priority]
+                waits = sorted(stats["waits"])
+                classes[priority] = {
+                    "queue_depth": sum(1 for _, _, t in self._queues[priority] if t.state == "waiting" and t.priority == priority),
+                    "in_flight": self._in_flight[priority],
+                    "dispatched": stats["dispatched"],
+                    "timeouts": stats["timeouts"],
+                    "wait_avg_ms": round(1000 * stats["wait_total"] / stats["dispatched"], 1) if stats["dispatched"] else 0.0,
+                    "wait_p95_ms": round(1000 * waits[int(0.95 * (len(waits) - 1))], 1) if waits else 0.0,
+                    "wait_max_ms": round(1000 * stats["wait_max"], 1)
+                }
+            return {
+                "concurrency_limit": int(self.concurrency_limit),
+                "tokens_per_minute": int(self.tpm),
+                "rate_limited_responses": self.throttled,
+                "classes": classes
+            }
+
+# Starting limits for the Nebius quota; both adapt downwards on 429s
+LLM_SCHEDULER = LLMScheduler(
+    max_concurrency=int(os.environ.get("NEBIUS_MAX_CONCURRENCY", 64)),
+    tokens_per_minute=int(os.environ.get("NEBIUS_TOKENS_PER_MINUTE", 400000))
+)
+
+def llm_rate_limit(error):
+    """(is 429, Retry-After seconds) for an exception raised by the OpenAI client."""
+    if getattr(error, "status_code", None) != 429:
+        return False, None
+    try:
+        return True, float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return True, None
+
+def run_llm_call(call):
+    if call.messages is None:
+        return call.result
+    try:
+        ticket = LLM_SCHEDULER.acquire(call)
+        try:
+            response = nebius_client().chat.completions.create(
+                model=NEBIUS_MODEL,
+                messages=call.messages,
+                **call.params
+            )
+        except Exception as e:
+            LLM_SCHEDULER.release(ticket, *llm_rate_limit(e))
+            raise
+        LLM_SCHEDULER.release(ticket)
+        return call.parse(response.choices[0].message.content)
+    except Exception as e:
+        print(f"Agent Error ({call.agent}): {e}")
+        return call.fallback()
+
+async def run_llm_call_async(call):
+    if call.messages is None:
+        return call.result
+    try:
+        ticket = await LLM_SCHEDULER.acquire_async(call)
+        try:
+            response = await nebius_async_client().chat.completions.create(
+                model=NEBIUS_MODEL,
+                messages=call.messages,
+                **call.params
+            )
+        except BaseException as e:
+            LLM_SCHEDULER.release(ticket, *llm_rate_limit(e))
+            raise
+        LLM_SCHEDULER.release(ticket)
+        return call.parse(response.choices[0].message.content)
+    except Exception as e:
+        print(f"Agent Error ({call.agent}): {e}")
+        return call.fallback()
+
 # --- INTELLIGENT AGENTS ---
 
 class ScoreImpactAgent:
@@ -78,11 +687,14 @@ class ScoreImpactAgent:
     """
     @staticmethod
     def get_dynamic_impacts(user_data, current_score_estimate):
-        client = OpenAI(
-            base_url="https://api.tokenfactory.nebius.com/v1/",
-            api_key=os.environ.get("NEBIUS_API_KEY")
-        )
+        return run_llm_call(ScoreImpactAgent.impacts_call(user_data, current_score_estimate))
+
+    @staticmethod
+    async def get_dynamic_impacts_async(user_data, current_score_estimate):
+        return await run_llm_call_async(ScoreImpactAgent.impacts_call(user_data, current_score_estimate))
 
+    @staticmethod
+    def impacts_call(user_data, current_score_estimate):
         system_prompt = """You are a Credit Score Logic Engine.
         Determine the dynamic score impact values for a user based on their current credit standing.
         
@@ -109,21 +721,18 @@ class ScoreImpactAgent:
         - Payment History: {user_data.get('payment_history', 'Unknown')}
         """
 
-        try:
-            response = client.chat.completions.create(
-                model="meta-llama/Llama-3.3-70B-Instruct-fast",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.5,
-                response_format={"type": "json_object"}
-            )
-            return json.loads(response.choices[0].message.content)
-        except Exception as e:
-            print(f"Agent Error (Score Impact): {e}")
+        return LLMCall(
+            "Score Impact",
+            username=user_data.get('username'),
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ],
+            temperature=0.5,
+            response_format={"type": "json_object"},
+            parse=json.loads,
             # Fallback defaults
-            return {
+            fallback=lambda: {
                 "emi_repayment": 2,
                 "cc_full_payment": 5,
                 "late_payment": 30,
@@ -131,6 +740,7 @@ class ScoreImpactAgent:
                 "new_account_penalty": 10,
                 "large_purchase_penalty": 15
             }
+        )
 
 class CreditCalculationAgent:
     """
@@ -176,23 +786,63 @@ class CreditCalculationAgent:
         score = int(base_score + payment_impact + util_impact - inquiry_penalty - new_account_penalty)
         return min(max(score, 300), 900)
 
+    @staticmethod
+    def calculate_batch(user_data, utilizations, impacts=None):
+        """
+        Vectorized calculate() over an array of candidate utilizations,
+        everything else taken from user_data.
+        """
+        utilizations = np.asarray(utilizations, dtype=np.float64)
+        if user_data.get('username') == 'user14':
+            return np.full(utilizations.shape, 900, dtype=np.int64)
+
+        # Default impacts if not provided
+        if impacts is None:
+            impacts = {
+                "inquiry_penalty": 5,
+                "new_account_penalty": 10
+            }
+
+        # Utilization is the only varying input, so everything else is scored once
+        transactions = user_data.get('transactions', [])
+        num_inquiries = sum(1 for tx in transactions if tx.get('type') == 'Credit_Inquiry' and tx.get('month_offset', 12) < 12)
+        num_new_accounts = sum(1 for tx in transactions if tx.get('type') == 'New_Account_Opened' and tx.get('month_offset', 12) < 12)
+        fixed_part = (300 + user_data.get('payment_history', 100) * 3.5
+                      - num_inquiries * impacts.get('inquiry_penalty', 5)
+                      - num_new_accounts * impacts.get('new_account_penalty', 10))
+
+        util_impact = np.maximum(0, (1.0 - utilizations) * 200)
+        scores = np.trunc(fixed_part + util_impact).astype(np.int64)
+        return np.clip(scores, 300, 900)
+
 class PredictionAgent:
     """
     Agent 2: The Analyst.
     Uses Nebius AI (Llama 3.3) to analyze data and suggest improvements.
     """
     @staticmethod
-    def analyze(user_data, current_score):
-        client = OpenAI(
-            base_url="https://api.tokenfactory.nebius.com/v1/",
-            api_key=os.environ.get("NEBIUS_API_KEY")
-        )
+    def analyze(user_data, current_score, projection=None):
+        return run_llm_call(PredictionAgent.analysis_call(user_data, current_score, projection))
+
+    @staticmethod
+    async def analyze_async(user_data, current_score, projection=None):
+        return await run_llm_call_async(PredictionAgent.analysis_call(user_data, current_score, projection))
+
+    @staticmethod
+    def analysis_call(user_data, current_score, projection=None):
+        # "projected_score" is the simulated median score in 6 months if the
+        # user's current behaviour continues (ScoreProjectionEngine), not a
+        # score for following the improvement plan; the LLM is not asked for it
+        if projection is None:
+            projection = ScoreProjectionEngine.project(user_data, current_score)
+        six_months = projection["horizons"]["6"]
+        projected_score = six_months["p50"]
 
         system_prompt = """You are an expert Credit Score Analyst Agent. 
         Analyze the user's financial data and provide:
         1. A brief summary of why their score is what it is.
         2. A list of 2-3 specific, actionable steps to improve their score.
-        3. A projected score if they follow these steps.
+        The simulated 6-month score assumes their current behaviour continues; use it as context only.
         
         Credit Scoring Rules (FICO based):
         - Payment History (35%): Late payments are very damaging.
@@ -204,7 +854,6 @@ class PredictionAgent:
         Return the response in strictly valid JSON format with keys: 
         - "analysis_summary": string
         - "improvement_plan": list of strings
-        - "projected_score": integer
         - "impact_factors": object with keys "payment_history" (string, e.g. "+35 pts"), "credit_age" (string), "utilization" (string), "inquiries" (string).
         """
 
@@ -217,45 +866,49 @@ class PredictionAgent:
         - Credit Utilization: {user_data.get('utilization')}
         - Missed Payments (12m): {user_data.get('num_missed_payments_12m', 0)}
         - Current Score: {current_score}
+        - Simulated Score in 6 Months (current behaviour continues): median {projected_score} (range {six_months['p10']}-{six_months['p90']})
         - Scenario: {user_data.get('scenario_title', 'N/A')}
         """
 
-        try:
-            # Special Case for User 13 (Volatile Recovery)
-            if user_data.get('username') == 'user13' or user_data.get('scenario_title') == 'Volatile Recovery':
-                return {
-                    "analysis_summary": "STRATEGY ALERT: The current improvement plan is failing. Score volatility is high due to inconsistent payment behavior despite recent recovery attempts.",
-                    "improvement_plan": [
-                        "IMMEDIATE ACTION: Automate payments to stop missing due dates.",
-                        "Stop using Cash Advances immediately (High Interest/Fees).",
-                        "Consolidate debt if possible to stabilize monthly outflows."
-                    ],
-                    "projected_score": current_score - 20, # Projected to drop if behavior continues
-                    "impact_factors": {
-                        "payment_history": "CRITICAL (-150 pts)",
-                        "utilization": "High (-50 pts)",
-                        "recent_trend": "Volatile"
-                    }
+        # Special Case for User 13 (Volatile Recovery)
+        if user_data.get('username') == 'user13' or user_data.get('scenario_title') == 'Volatile Recovery':
+            return LLMCall("Nebius", result={
+                "analysis_summary": "STRATEGY ALERT: The current improvement plan is failing. Score volatility is high due to inconsistent payment behavior despite recent recovery attempts.",
+                "improvement_plan": [
+                    "IMMEDIATE ACTION: Automate payments to stop missing due dates.",
+                    "Stop using Cash Advances immediately (High Interest/Fees).",
+                    "Consolidate debt if possible to stabilize monthly outflows."
+                ],
+                "projected_score": projected_score, # Simulation projects a drop if behavior continues
+                "impact_factors": {
+                    "payment_history": "CRITICAL (-150 pts)",
+                    "utilization": "High (-50 pts)",
+                    "recent_trend": "Volatile"
                 }
+            })
 
-            response = client.chat.completions.create(
-                model="meta-llama/Llama-3.3-70B-Instruct-fast",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.7,
-                response_format={"type": "json_object"}
-            )
-            return json.loads(response.choices[0].message.content)
-        except Exception as e:
-            print(f"Agent Error (Nebius): {e}")
-            return {
+        def parse(content):
+            result = json.loads(content)
+            result["projected_score"] = projected_score
+            return result
+
+        return LLMCall(
+            "Nebius",
+            username=user_data.get('username'),
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ],
+            temperature=0.7,
+            response_format={"type": "json_object"},
+            parse=parse,
+            fallback=lambda: {
                 "analysis_summary": "AI Agent temporarily unavailable.",
                 "improvement_plan": ["Maintain on-time payments.", "Keep utilization low."],
-                "projected_score": current_score + 10,
+                "projected_score": projected_score,
                 "impact_factors": {"payment_history": "+30 pts", "utilization": "+10 pts"}
             }
+        )
 
 class AlertingAgent:
     """
@@ -264,31 +917,15 @@ class AlertingAgent:
     """
     @staticmethod
     def check_alerts(user_data):
+        # Alerts are raised by the rule engine as transactions arrive,
+        # so known users are served straight from the store
+        username = user_data.get('username')
+        if ALERT_ENGINE.is_indexed(username):
+            return ALERT_ENGINE.alerts_for(username)
+
         alerts = []
-        transactions = user_data.get('transactions', [])
-        
-        # Simple logic: Flag large transactions or late payments
-        for tx in transactions:
-            is_alert = False
-            if tx.get('amount', 0) > 50000 and tx.get('type') != 'EMI_Repayment':
-                 alerts.append({
-                    "type": "SPENDING",
-                    "severity": "MEDIUM",
-                    "message": f"Large transaction detected: ${tx['amount']} ({tx.get('type')})"
-                })
-                 is_alert = True
-            
-            status = tx.get('status', '')
-            if 'Late' in status or 'Missed' in status:
-                 alerts.append({
-                    "type": "VIOLATION",
-                    "severity": "HIGH",
-                    "message": f"Payment Issue: {status} for ${tx['amount']}"
-                })
-                 is_alert = True
-            
-            if is_alert:
-                tx['alert'] = True
+        for tx in user_data.get('transactions', []):
+            alerts.extend(alert for _, alert in ALERT_ENGINE.evaluate(tx))
                 
         return alerts
 
@@ -298,11 +935,14 @@ class FinancialPlanAgent:
     """
     @staticmethod
     def generate_plans(user_data, current_score):
-        client = OpenAI(
-            base_url="https://api.tokenfactory.nebius.com/v1/",
-            api_key=os.environ.get("NEBIUS_API_KEY")
-        )
+        return run_llm_call(FinancialPlanAgent.plans_call(user_data, current_score))
+
+    @staticmethod
+    async def generate_plans_async(user_data, current_score):
+        return await run_llm_call_async(FinancialPlanAgent.plans_call(user_data, current_score))
 
+    @staticmethod
+    def plans_call(user_data, current_score):
         system_prompt = """You are a Financial Advisor Agent.
         Based on the user's credit score and income, suggest:
         1. Loan Eligibility.
@@ -330,20 +970,18 @@ class FinancialPlanAgent:
         Savings: {user_data.get('savings_balance')}
         """
 
-        try:
-            response = client.chat.completions.create(
-                model="meta-llama/Llama-3.3-70B-Instruct-fast",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.7,
-                response_format={"type": "json_object"}
-            )
-            return json.loads(response.choices[0].message.content)
-        except Exception as e:
-            print(f"Agent Error (Financial Plan): {e}")
-            return {"loans": [], "investments": []}
+        return LLMCall(
+            "Financial Plan",
+            username=user_data.get('username'),
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ],
+            temperature=0.7,
+            response_format={"type": "json_object"},
+            parse=json.loads,
+            fallback=lambda: {"loans": [], "investments": []}
+        )
 
 class GoalSettingAgent:
     """
@@ -352,11 +990,14 @@ class GoalSettingAgent:
     """
     @staticmethod
     def generate_goal_plan(user_data, goal):
-        client = OpenAI(
-            base_url="https://api.tokenfactory.nebius.com/v1/",
-            api_key=os.environ.get("NEBIUS_API_KEY")
-        )
+        return run_llm_call(GoalSettingAgent.goal_plan_call(user_data, goal))
+
+    @staticmethod
+    async def generate_goal_plan_async(user_data, goal):
+        return await run_llm_call_async(GoalSettingAgent.goal_plan_call(user_data, goal))
 
+    @staticmethod
+    def goal_plan_call(user_data, goal):
         system_prompt = """You are a Financial Strategy Agent.
         The user has a specific financial goal (e.g., "Buy a House", "Get a Car Loan", "Clear Debt").
         Analyze their current profile and provide a tailored improvement plan to achieve this goal.
@@ -378,25 +1019,23 @@ class GoalSettingAgent:
         User Goal: {goal}
         """
 
-        try:
-            response = client.chat.completions.create(
-                model="meta-llama/Llama-3.3-70B-Instruct-fast",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.7,
-                response_format={"type": "json_object"}
-            )
-            return json.loads(response.choices[0].message.content)
-        except Exception as e:
-            print(f"Agent Error (Goal Setting): {e}")
-            return {
+        return LLMCall(
+            "Goal Setting",
+            username=user_data.get('username'),
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ],
+            temperature=0.7,
+            response_format={"type": "json_object"},
+            parse=json.loads,
+            fallback=lambda: {
                 "plan_steps": ["Maintain on-time payments", "Reduce debt"],
                 "target_score": 750,
                 "timeline": "Unknown",
                 "feasibility": "Unknown"
             }
+        )
 
 class LimitGeneratorAgent:
     """
@@ -406,25 +1045,27 @@ class LimitGeneratorAgent:
     """
     @staticmethod
     def generate_limits(user_data):
-        client = OpenAI(
-            base_url="https://api.tokenfactory.nebius.com/v1/",
-            api_key=os.environ.get("NEBIUS_API_KEY")
-        )
+        return run_llm_call(LimitGeneratorAgent.limits_call(user_data))
+
+    @staticmethod
+    async def generate_limits_async(user_data):
+        return await run_llm_call_async(LimitGeneratorAgent.limits_call(user_data))
 
+    @staticmethod
+    def limits_call(user_data):
         current_goal = user_data.get('current_goal')
         goal_amount = user_data.get('goal_amount', 0)
-        goal_plan = user_data.get('goal_plan', {})
+        goal_plan = user_data.get('goal_plan') or {}
         
         # --- Calculate Base Safe Limit (No Goal) ---
-        # Logic: Savings - Emergency Fund (1 month expenses or 10% savings)
-        current_savings = user_data.get('savings_balance', 0)
-        monthly_spend = user_data.get('monthly_spend', 0)
-        emergency_fund = max(int(current_savings * 0.1), int(monthly_spend))
-        safe_limit_no_goal = max(0, current_savings - emergency_fund)
-        max_limit_base = max(0, current_savings - int(monthly_spend * 0.5)) # Absolute max leaves 50% of 1 month expenses
+        inputs = LimitGeneratorAgent.limit_inputs(user_data)
+        current_savings = inputs['current_savings']
+        monthly_spend = inputs['monthly_spend']
+        safe_limit_no_goal = inputs['safe_limit_no_goal']
+        max_limit_base = inputs['max_limit_base']
 
         if not current_goal:
-            return {
+            return LLMCall("Limit Generator", result={
                 "status": "NA",
                 "message": "No active goal set.",
                 "safe_limit_no_goal": safe_limit_no_goal,
@@ -432,7 +1073,7 @@ class LimitGeneratorAgent:
                 "max_limit": max_limit_base,
                 "goal_value": "N/A",
                 "impact_analysis": "Set a financial goal to generate smart payment limits."
-            }
+            })
 
         # Extract goal analysis data
         target_score = goal_plan.get('target_score', 750)
@@ -443,19 +1084,8 @@ class LimitGeneratorAgent:
         # Calculate monthly savings needed for goal
         monthly_income = user_data.get('income', 0) / 12
         monthly_disposable = monthly_income - monthly_spend
-        current_debt = user_data.get('debt', 0)
-        
-        # Parse timeline to estimate months needed
-        months_needed = 12  # default
-        if 'month' in timeline.lower():
-            try:
-                # Extract number from timeline like "6-12 months"
-                import re
-                numbers = re.findall(r'\d+', timeline)
-                if numbers:
-                    months_needed = int(numbers[-1])  # Use the upper bound
-            except:
-                pass
+        current_debt = inputs['current_debt']
+        months_needed = inputs['months_needed']
 
         system_prompt = f"""You are a Financial Limit Generator Agent working with the Goal Setting Agent's analysis.
 
@@ -516,17 +1146,8 @@ Goal Requirements:
 Question: What's the maximum they can pay RIGHT NOW while staying on track for their goal?
 """
 
-        try:
-            response = client.chat.completions.create(
-                model="meta-llama/Llama-3.3-70B-Instruct-fast",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.2,  # Very low for consistent financial calculations
-                response_format={"type": "json_object"}
-            )
-            result = json.loads(response.choices[0].message.content)
+        def parse(content):
+            result = json.loads(content)
             result["status"] = "Active"
             
             # Ensure limits are integers and sensible
@@ -541,37 +1162,96 @@ Question: What's the maximum they can pay RIGHT NOW while staying on track for t
             result["safe_limit_no_goal"] = safe_limit_no_goal
             
             return result
-            
-        except Exception as e:
-            print(f"Agent Error (Limit Generator): {e}")
-            
+
+        return LLMCall(
+            "Limit Generator",
+            username=user_data.get('username'),
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ],
+            temperature=0.2,  # Very low for consistent financial calculations
+            response_format={"type": "json_object"},
+            parse=parse,
             # INTELLIGENT FALLBACK (not hardcoded!)
-            # Calculate based on actual goal requirements
-            
-            # How much do they need to keep for the goal?
-            monthly_savings_needed = int(goal_amount / months_needed) if months_needed > 0 and goal_amount > 0 else 0
-            total_savings_needed = monthly_savings_needed * months_needed
-            
-            # Safe limit: Can spend what's NOT needed for goal + emergency
-            safe_limit = max(0, current_savings - total_savings_needed - emergency_fund)
-            
-            # Max limit: Can spend up to savings minus emergency fund
-            max_limit = max(0, current_savings - emergency_fund)
-            
-            # If goal amount is 0 or very small, use debt-focused logic
-            if goal_amount == 0 or goal_amount < current_debt:
-                # Goal might be to pay off debt
-                safe_limit = min(current_debt, int(current_savings * 0.8))
-                max_limit = min(current_debt, int(current_savings * 0.95))
-            
-            return {
-                "status": "Active",
-                "safe_limit": int(safe_limit),
-                "safe_limit_no_goal": safe_limit_no_goal,
-                "max_limit": int(max_limit),
-                "goal_value": f"${goal_amount:,}" if goal_amount > 0 else "Goal-focused savings",
-                "impact_analysis": f"Calculated based on your {timeline} timeline: You need to save ${monthly_savings_needed:,}/month. Paying more than ${safe_limit:,} would jeopardize your ability to reach '{current_goal}' on schedule."
-            }
+            fallback=lambda: LimitGeneratorAgent.deterministic_limits(user_data, inputs)
+        )
+
+    @staticmethod
+    def limit_inputs(user_data):
+        """
+        Deterministic quantities behind every limit: emergency fund, base limits
+        and how much must be kept aside for the current goal.
+        """
+        # Logic: Savings - Emergency Fund (1 month expenses or 10% savings)
+        current_savings = user_data.get('savings_balance', 0)
+        monthly_spend = user_data.get('monthly_spend', 0)
+        emergency_fund = max(int(current_savings * 0.1), int(monthly_spend))
+        goal_amount = user_data.get('goal_amount', 0) or 0
+        timeline = (user_data.get('goal_plan') or {}).get('timeline', 'Unknown')
+
+        # Parse timeline to estimate months needed
+        months_needed = 12  # default
+        if 'month' in timeline.lower():
+            try:
+                # Extract number from timeline like "6-12 months"
+                import re
+                numbers = re.findall(r'\d+', timeline)
+                if numbers:
+                    months_needed = int(numbers[-1])  # Use the upper bound
+            except:
+                pass
+
+        # How much do they need to keep for the goal?
+        monthly_savings_needed = int(goal_amount / months_needed) if months_needed > 0 and goal_amount > 0 else 0
+
+        return {
+            "current_savings": current_savings,
+            "monthly_spend": monthly_spend,
+            "current_debt": user_data.get('debt', 0),
+            "emergency_fund": emergency_fund,
+            "safe_limit_no_goal": max(0, current_savings - emergency_fund),
+            "max_limit_base": max(0, current_savings - int(monthly_spend * 0.5)), # Absolute max leaves 50% of 1 month expenses
+            "goal_amount": goal_amount,
+            "timeline": timeline,
+            "months_needed": months_needed,
+            "monthly_savings_needed": monthly_savings_needed,
+            "total_savings_needed": monthly_savings_needed * months_needed
+        }
+
+    @staticmethod
+    def deterministic_limits(user_data, inputs=None):
+        """
+        Rule-based goal limits. Used when the LLM is unavailable and by the what-if simulator.
+        """
+        inputs = inputs or LimitGeneratorAgent.limit_inputs(user_data)
+        current_goal = user_data.get('current_goal')
+        current_savings = inputs['current_savings']
+        current_debt = inputs['current_debt']
+        emergency_fund = inputs['emergency_fund']
+        goal_amount = inputs['goal_amount']
+        monthly_savings_needed = inputs['monthly_savings_needed']
+
+        # Safe limit: Can spend what's NOT needed for goal + emergency
+        safe_limit = max(0, current_savings - inputs['total_savings_needed'] - emergency_fund)
+        
+        # Max limit: Can spend up to savings minus emergency fund
+        max_limit = max(0, current_savings - emergency_fund)
+        
+        # If goal amount is 0 or very small, use debt-focused logic
+        if goal_amount == 0 or goal_amount < current_debt:
+            # Goal might be to pay off debt
+            safe_limit = min(current_debt, int(current_savings * 0.8))
+            max_limit = min(current_debt, int(current_savings * 0.95))
+        
+        return {
+            "status": "Active",
+            "safe_limit": int(safe_limit),
+            "safe_limit_no_goal": inputs['safe_limit_no_goal'],
+            "max_limit": int(max_limit),
+            "goal_value": f"${goal_amount:,}" if goal_amount > 0 else "Goal-focused savings",
+            "impact_analysis": f"Calculated based on your {inputs['timeline']} timeline: You need to save ${monthly_savings_needed:,}/month. Paying more than ${safe_limit:,} would jeopardize your ability to reach '{current_goal}' on schedule."
+        }
 
 class PaymentAgent:
     """
@@ -580,11 +1260,14 @@ class PaymentAgent:
     """
     @staticmethod
     def evaluate_payment(user_data, payment_amount):
-        client = OpenAI(
-            base_url="https://api.tokenfactory.nebius.com/v1/",
-            api_key=os.environ.get("NEBIUS_API_KEY")
-        )
+        return run_llm_call(PaymentAgent.payment_call(user_data, payment_amount))
 
+    @staticmethod
+    async def evaluate_payment_async(user_data, payment_amount):
+        return await run_llm_call_async(PaymentAgent.payment_call(user_data, payment_amount))
+
+    @staticmethod
+    def payment_call(user_data, payment_amount):
         system_prompt = """You are a Payment Authorization Agent.
         Your job is to approve or reject a payment request based on the user's financial health.
         
@@ -606,11 +1289,11 @@ class PaymentAgent:
         current_debt = user_data.get('debt', 0)
 
         if payment_amount > current_debt:
-             return {
+             return LLMCall("Payment", result={
                 "approved": False, 
                 "reason": "This payment exceeds your outstanding debt. Proceeding with this overpayment would be an inefficient use of your funds and negatively impact your financial plan.", 
                 "remaining_balance": user_data.get('savings_balance')
-            }
+            })
 
         user_message = f"""
         User Financial State:
@@ -622,25 +1305,26 @@ class PaymentAgent:
         - Amount: ${payment_amount}
         """
 
-        try:
-            response = client.chat.completions.create(
-                model="meta-llama/Llama-3.3-70B-Instruct-fast",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.1, # Low temperature for strict logic
-                response_format={"type": "json_object"}
-            )
-            return json.loads(response.choices[0].message.content)
-        except Exception as e:
-            print(f"Agent Error (Payment): {e}")
-            # Fallback logic
+        # Fallback logic
+        def fallback():
             if user_data.get('savings_balance', 0) >= payment_amount:
                 return {"approved": True, "reason": "Approved (Fallback logic)", "remaining_balance": user_data.get('savings_balance') - payment_amount}
             else:
                 return {"approved": False, "reason": "Insufficient funds (Fallback logic)", "remaining_balance": user_data.get('savings_balance')}
 
+        return LLMCall(
+            "Payment",
+            username=user_data.get('username'),
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ],
+            temperature=0.1, # Low temperature for strict logic
+            response_format={"type": "json_object"},
+            parse=json.loads,
+            fallback=fallback
+        )
+
 def calculate_score_for_month(base_score, transactions_up_to_month):
     # Calculate score based on events up to this point
     score = base_score
@@ -680,7 +1364,45 @@ def calculate_score_for_month(base_score, transactions_up_to_month):
              
     return min(max(score, 300), 900)
 
-def generate_chart_history(user_data, current_score, impacts):
+# Score-moving events a transaction can produce, in the order they are applied
+SCORE_EVENTS = ("late", "paid", "completed", "inquiry", "cash_advance", "large_purchase", "new_account")
+
+def transaction_score_events(tx):
+    """Maps a transaction to the score events used by the chart history rules."""
+    events = []
+    status = tx.get('status', '')
+    tx_type = tx.get('type', '')
+    
+    if 'Late' in status or 'Missed' in status:
+        events.append("late")
+    elif 'Paid' in status:
+        events.append("paid")
+    elif 'Completed' in status:
+        events.append("completed")
+        
+    if tx_type == 'Credit_Inquiry':
+        events.append("inquiry")
+    if tx_type == 'Cash_Advance':
+        events.append("cash_advance")
+    if tx_type == 'Large_Purchase':
+        events.append("large_purchase")
+    if tx_type == 'New_Account_Opened':
+        events.append("new_account")
+    return events
+
+def score_event_deltas(impacts):
+    """Signed score change per event, driven by the Score Impact Agent's values."""
+    return {
+        "late": -impacts.get('late_payment', 30), # Dynamic penalty
+        "paid": impacts.get('cc_full_payment', 5), # Dynamic gain
+        "completed": impacts.get('emi_repayment', 2), # Dynamic gain
+        "inquiry": -impacts.get('inquiry_penalty', 5),
+        "cash_advance": -impacts.get('large_purchase_penalty', 15), # Treat as large purchase/risk
+        "large_purchase": -impacts.get('large_purchase_penalty', 10),
+        "new_account": -impacts.get('new_account_penalty', 10)
+    }
+
+def generate_chart_history(user_data, current_score, impacts):
     # Generate 12 months of history based on the transactions in user_data
     # The transactions have 'month_offset' (0 = current month, 1 = last month, etc.)
     
@@ -704,6 +1426,7 @@ def generate_chart_history(user_data, current_score, impacts):
     
     raw_scores = []
     running_score = 720 # Starting baseline
+    deltas = score_event_deltas(impacts)
     
     transactions = user_data.get('transactions', [])
     
@@ -722,24 +1445,8 @@ def generate_chart_history(user_data, current_score, impacts):
         month_txs = tx_by_month[offset]
         
         for tx in month_txs:
-            status = tx.get('status', '')
-            tx_type = tx.get('type', '')
-            
-            if 'Late' in status or 'Missed' in status:
-                running_score -= impacts.get('late_payment', 30) # Dynamic penalty
-            elif 'Paid' in status:
-                running_score += impacts.get('cc_full_payment', 5) # Dynamic gain
-            elif 'Completed' in status:
-                running_score += impacts.get('emi_repayment', 2) # Dynamic gain
-                
-            if tx_type == 'Credit_Inquiry':
-                running_score -= impacts.get('inquiry_penalty', 5)
-            if tx_type == 'Cash_Advance':
-                running_score -= impacts.get('large_purchase_penalty', 15) # Treat as large purchase/risk
-            if tx_type == 'Large_Purchase':
-                running_score -= impacts.get('large_purchase_penalty', 10)
-            if tx_type == 'New_Account_Opened':
-                running_score -= impacts.get('new_account_penalty', 10)
+            for event in transaction_score_events(tx):
+                running_score += deltas[event]
                 
         raw_scores.append(running_score)
         
@@ -815,17 +1522,1608 @@ def explain_score_movements(user_data, history):
             
     return movements[::-1] # Most recent first
 
+# --- ALERT RULES ---
+# Alert rules are declared as data. Each rule is compiled once into a
+# predicate and evaluated once per transaction as it arrives; the resulting
+# alerts are stored per user, so serving them is a lookup.
+ALERT_RULES = [
+    {
+        "id": "large_spending",
+        "type": "SPENDING",
+        "severity": "MEDIUM",
+        "when": {"amount_gt": 50000, "type_not_in": ["EMI_Repayment"]},
+        "message": "Large transaction detected: ${amount} ({type})"
+    },
+    {
+        "id": "payment_issue",
+        "type": "VIOLATION",
+        "severity": "HIGH",
+        "when": {"status_contains_any": ["Late", "Missed"]},
+        "message": "Payment Issue: {status} for ${amount}"
+    }
+]
+
+# Condition operators available to rules: name -> (transaction field, test)
+ALERT_CONDITIONS = {
+    "amount_gt": ("amount", lambda value, arg: value > arg),
+    "amount_gte": ("amount", lambda value, arg: value >= arg),
+    "amount_lt": ("amount", lambda value, arg: value < arg),
+    "type_in": ("type", lambda value, arg: value in arg),
+    "type_not_in": ("type", lambda value, arg: value not in arg),
+    "status_contains_any": ("status", lambda value, arg: any(word in value for word in arg)),
+    "month_offset_lt": ("month_offset", lambda value, arg: value < arg)
+}
+
+ALERT_FIELD_DEFAULTS = {"amount": 0, "type": "", "status": "", "month_offset": 0}
+
+class _AlertFormatFields(dict):
+    def __missing__(self, key):
+        return ""
+
+def compile_alert_rule(rule):
+    """Turns a rule's "when" block into a single predicate over a transaction."""
+    checks = []
+    for name, arg in rule.get("when", {}).items():
+        if name not in ALERT_CONDITIONS:
+            raise ValueError(f"Unknown alert condition '{name}' in rule '{rule.get('id')}'")
+        field, test = ALERT_CONDITIONS[name]
+        if isinstance(arg, list):
+            arg = frozenset(arg) if name.endswith("_in") else tuple(arg)
+        checks.append((field, ALERT_FIELD_DEFAULTS.get(field), test, arg))
+
+    def predicate(tx):
+        for field, default, test, arg in checks:
+            if not test(tx.get(field, default), arg):
+                return False
+        return True
+    return predicate
+
+class AlertEngine:
+    """
+    Evaluates compiled alert rules at ingest time and keeps the resulting
+    alerts per user, keyed by (rule, transaction). Transactions are identified
+    by their ingest sequence number, not their contents, so two identical
+    events (e.g. two Missed EMIs for the same amount) raise two alerts.
+    """
+    def __init__(self, rules):
+        self.rules = [(rule, compile_alert_rule(rule)) for rule in rules]
+        self._alerts = {}
+        self._seq = {}
+        self._lock = threading.Lock()
+
+    def evaluate(self, tx):
+        alerts = []
+        for rule, predicate in self.rules:
+            if predicate(tx):
+                alerts.append((
+                    rule["id"],
+                    {
+                        "type": rule["type"],
+                        "severity": rule["severity"],
+                        "message": rule["message"].format_map(_AlertFormatFields(tx))
+                    }
+                ))
+        return alerts
+
+    def ingest(self, username, tx):
+        """Evaluates one arriving transaction (each call is a new transaction). Returns the alerts it raised."""
+        alerts = self.evaluate(tx)
+        with self._lock:
+            seq = self._seq.get(username, 0)
+            self._seq[username] = seq + 1
+            user_alerts = self._alerts.setdefault(username, {})
+            for rule_id, alert in alerts:
+                user_alerts[(rule_id, seq)] = alert
+        return [alert for _, alert in alerts]
+
+    def index_user(self, username, user_data):
+        with self._lock:
+            self._alerts[username] = {}
+            self._seq[username] = 0
+        for tx in user_data.get('transactions', []):
+            self.ingest(username, tx)
+
+    def annotate(self, transactions):
+        """The transactions with alert=True on those that raise an alert (copies; the originals stay untouched)."""
+        return [dict(tx, alert=True) if self.evaluate(tx) else tx for tx in transactions]
+
+    def is_indexed(self, username):
+        return username in self._alerts
+
+    def alerts_for(self, username):
+        with self._lock:
+            return list(self._alerts.get(username, {}).values())
+
+ALERT_ENGINE = AlertEngine(ALERT_RULES)
+for _username, _user in USER_DATA.items():
+    ALERT_ENGINE.index_user(_username, _user)
+
+# --- TRANSACTION INGESTION ---
+
+# month_offset 0 is the dataset's current month (Dec 2025)
+REFERENCE_YEAR, REFERENCE_MONTH = 2025, 12
+
+SPEND_TYPES = {"Normal_Transaction", "Large_Purchase", "Cash_Advance"}
+CARD_PAYMENT_TYPES = {"CC_Full_Payment", "CC_Min_Payment"}
+LOAN_PAYMENT_TYPES = {"EMI_Repayment", "Loan_Repayment", "Final_Loan_Payment"}
+INGEST_REQUIRED_FIELDS = ("username", "date", "type", "amount", "status")
+
+def month_offset_for(date):
+    year, month = int(date[0:4]), int(date[5:7])
+    return max(0, (REFERENCE_YEAR * 12 + REFERENCE_MONTH) - (year * 12 + month))
+
+def is_missed_status(status):
+    return 'Late' in status or 'Missed' in status
+
+class MonthBuckets:
+    """Per-user month buckets ("YYYY-MM" -> counts and totals), updated per transaction."""
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def add(self, username, tx):
+        month = tx.get('date', '')[:7]
+        with self._lock:
+            bucket = self._buckets.setdefault(username, {}).setdefault(
+                month, {"count": 0, "spend": 0, "payments": 0, "missed": 0})
+            bucket["count"] += 1
+            if tx.get('type') in SPEND_TYPES:
+                bucket["spend"] += tx.get('amount', 0)
+            elif (tx.get('type') in CARD_PAYMENT_TYPES or tx.get('type') in LOAN_PAYMENT_TYPES) \
+                    and 'missed' not in tx.get('status', '').lower():
+                # A missed payment moves no money (as in apply_transaction)
+                bucket["payments"] += tx.get('amount', 0)
+            if is_missed_status(tx.get('status', '')):
+                bucket["missed"] += 1
+
+    def index_user(self, username, user_data):
+        with self._lock:
+            self._buckets[username] = {}
+        for tx in user_data.get('transactions', []):
+            self.add(username, tx)
+
+    def for_user(self, username):
+        with self._lock:
+            return {month: dict(bucket) for month, bucket in sorted(self._buckets.get(username, {}).items(), reverse=True)}
+
+MONTH_BUCKETS = MonthBuckets()
+for _username, _user in USER_DATA.items():
+    MONTH_BUCKETS.index_user(_username, _user)
+
+def apply_transaction(user, tx):
+    """
+    Appends one transaction to a user draft (see update_user) and updates
+    the derived aggregates incrementally instead of rebuilding the user offline.
+    """
+    amount = tx['amount']
+    tx_type = tx['type']
+    status = tx['status']
+    missed = 'missed' in status.lower()
+
+    # Balances (a missed payment moves no money)
+    if tx_type in SPEND_TYPES:
+        user['current_balance'] = user.get('current_balance', 0) + amount
+    elif tx_type in CARD_PAYMENT_TYPES and not missed:
+        user['current_balance'] = max(0, user.get('current_balance', 0) - amount)
+    elif tx_type in LOAN_PAYMENT_TYPES and not missed and 'debt' in user:
+        user['debt'] = max(0, user['debt'] - amount)
+    if tx_type == 'Cash_Advance':
+        user['cash_advance_amt'] = user.get('cash_advance_amt', 0) + amount
+
+    # Counters over the trailing windows (utilization and payment_history follow via DERIVED_FIELDS)
+    if is_missed_status(status) and tx['month_offset'] < 12:
+        user['num_missed_payments_12m'] = user.get('num_missed_payments_12m', 0) + 1
+    if tx_type == 'Credit_Inquiry' and tx['month_offset'] < 6:
+        user['num_new_inquiries_6m'] = user.get('num_new_inquiries_6m', 0) + 1
+
+    # Transactions are stored newest month first (month_offset ascending) and
+    # oldest date first within a month: binary search for the slot, after
+    # any existing transactions with the same month and date
+    transactions = user.setdefault('transactions', [])
+    key = (tx['month_offset'], tx['date'])
+    lo, hi = 0, len(transactions)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if (transactions[mid].get('month_offset', 0), transactions[mid].get('date', '')) <= key:
+            lo = mid + 1
+        else:
+            hi = mid
+    transactions.insert(lo, tx)
+
+def parse_ingest_record(record):
+    """Validates an incoming record and shapes it like the stored transactions."""
+    if not isinstance(record, dict):
+        raise ValueError("Record must be a JSON object")
+    missing = [f for f in INGEST_REQUIRED_FIELDS if record.get(f) in (None, "")]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+    if get_user_by_username(record['username']) is None:
+        raise ValueError("User not found")
+    amount = record['amount']
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount < 0:
+        raise ValueError("Amount must be a non-negative number")
+    date = str(record['date'])
+    try:
+        datetime.strptime(date[:10], "%Y-%m-%d")
+    except ValueError:
+        raise ValueError("Date must be YYYY-MM-DD")
+
+    tx = {
+        "month_offset": month_offset_for(date),
+        "date": date[:10],
+        "type": str(record['type']),
+        "amount": amount,
+        "status": str(record['status'])
+    }
+    for optional in ("merchant", "category"):
+        if record.get(optional):
+            tx[optional] = str(record[optional])
+    return record['username'], tx
+
+class IngestPipeline:
+    """
+    Streams transactions through a bounded queue into a single consumer
+    thread that applies them in batches and persists at most once per
+    `persist_interval` seconds. A full queue pushes back on the producer.
+    """
+    def __init__(self, max_queue=10000, batch_size=500, persist_interval=2.0, put_timeout=5.0):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.persist_interval = persist_interval
+        self.put_timeout = put_timeout
+        self.applied = 0
+        self._dirty = False
+        self._last_persist = time.monotonic()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._consume, name="ingest", daemon=True)
+                self._thread.start()
+
+    def submit(self, username, tx):
+        """Queues one transaction. Returns False if the queue stayed full (backpressure)."""
+        try:
+            self.queue.put((username, tx), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def flush(self):
+        """Blocks until everything queued so far is applied and persisted."""
+        self.queue.join()
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _consume(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self.apply_batch(batch)
+            except Exception as e:
+                print(f"Ingest Error: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def apply_batch(self, batch):
+        # One new snapshot per user per batch
+        by_user = {}
+        for username, tx in batch:
+            by_user.setdefault(username, []).append(tx)
+
+        touched = set()
+        for username, txs in by_user.items():
+            def apply_all(draft, txs=txs):
+                for tx in txs:
+                    apply_transaction(draft, tx)
+
+            def index_all(user, username=username, txs=txs):
+                # Indexed before the version is visible, so a dashboard for it
+                # never caches monthly activity or alerts from before the batch
+                for tx in txs:
+                    MONTH_BUCKETS.add(username, tx)
+                    ALERT_ENGINE.ingest(username, tx)
+            user = update_user(username, apply_all, before_commit=index_all)
+            if user is None:
+                continue
+            COHORTS.update(username, user, snapshot_score(user))
+            touched.add(username)
+        self.applied += len(batch)
+        self._dirty = self._dirty or bool(touched)
+
+        # Persist in batches rather than per transaction; always persist once the queue drains
+        now = time.monotonic()
+        if self._dirty and (self.queue.empty() or now - self._last_persist >= self.persist_interval):
+            save_user_data()
+            self._dirty = False
+            self._last_persist = now
+
+INGEST = IngestPipeline()
+
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/jsonl", "application/ndjson")
+
+def ndjson_records(stream):
+    """Yields (line number, record) from an NDJSON byte stream; undecodable lines yield None."""
+    # Buffer the raw stream, otherwise lines are read a byte at a time
+    for line_no, line in enumerate(io.BufferedReader(stream, 1 << 16), start=1):
+        line = line.strip()
+        if line:
+            try:
+                yield line_no, json_loads(line)
+            except ValueError:
+                yield line_no, None
+
+def json_records(data):
+    """Yields (index, record) from a JSON array / {"transactions": [...]} batch."""
+    if isinstance(data, dict):
+        data = data.get("transactions", [data])
+    if not isinstance(data, list):
+        raise ValueError("Body must be NDJSON or a JSON array of transactions")
+    for index, record in enumerate(data, start=1):
+        yield index, record
+
+def iter_ingest_records():
+    """
+    Yields decoded records from the request body: NDJSON streamed line by
+    line, or a JSON array / {"transactions": [...]} batch.
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        return ndjson_records(request.stream)
+    return json_records(request.get_json(silent=True))
+
+def submit_ingest_records(records, wait=False):
+    """Validates and queues decoded records. Returns (payload, status)."""
+    INGEST.start()
+    accepted = 0
+    rejected = []
+
+    try:
+        for line_no, record in records:
+            try:
+                if record is None:
+                    raise ValueError("Invalid JSON")
+                username, tx = parse_ingest_record(record)
+            except ValueError as e:
+                rejected.append({"line": line_no, "error": str(e)})
+                continue
+            if not INGEST.submit(username, tx):
+                return {
+                    "status": "error",
+                    "message": "Ingest queue is full. Retry the remaining records later.",
+                    "accepted": accepted,
+                    "rejected": rejected
+                }, 503
+            accepted += 1
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}, 400
+
+    # wait=True returns only once the records are applied and persisted
+    if wait:
+        INGEST.flush()
+
+    return {"status": "success", "accepted": accepted, "rejected": rejected}, 200
+
+# --- SCORE PROJECTION ---
+
+# Events driven by spending behaviour, scaled by the user's spend growth
+SPEND_EVENTS = ("cash_advance", "large_purchase")
+PAYMENT_OUTCOMES = ("late", "paid", "completed")
+PROJECTION_PERCENTILES = (10, 25, 50, 75, 90)
+
+class ScoreProjectionEngine:
+    """
+    Deterministic, seeded Monte Carlo projection of the score.
+    Each path samples monthly transaction outcomes from the user's own last
+    12 months (payment count and late rate, inquiry/new account rates,
+    spend-driven events grown by spend_growth_3m) and applies the same impact
+    rules as generate_chart_history. Returns percentile bands per horizon.
+    """
+    @staticmethod
+    def history_rates(user_data, history_months=12):
+        counts = {event: 0 for event in SCORE_EVENTS}
+        for tx in user_data.get('transactions', []):
+            if tx.get('month_offset', 12) < history_months:
+                for event in transaction_score_events(tx):
+                    counts[event] += 1
+
+        # Reported counters can be ahead of the transaction log
+        counts["late"] = max(counts["late"], user_data.get('num_missed_payments_12m', 0) or 0)
+        counts["inquiry"] = max(counts["inquiry"], 2 * (user_data.get('num_new_inquiries_6m', 0) or 0))
+
+        payments = sum(counts[o] for o in PAYMENT_OUTCOMES)
+        return {
+            "payments_per_month": payments / history_months,
+            "outcome_probs": [counts[o] / payments if payments else 1.0 / len(PAYMENT_OUTCOMES) for o in PAYMENT_OUTCOMES],
+            "event_rates": {e: counts[e] / history_months for e in SCORE_EVENTS if e not in PAYMENT_OUTCOMES},
+            "spend_growth_3m": max(-0.9, float(user_data.get('spend_growth_3m', 0) or 0))
+        }
+
+    @staticmethod
+    def project(user_data, current_score, impacts=None, horizons=(6, 12), n_paths=4000, seed=None):
+        if seed is None:
+            seed = zlib.crc32(str(user_data.get('username', '')).encode())
+        rng = np.random.default_rng(seed)
+        months = max(horizons)
+        rates = ScoreProjectionEngine.history_rates(user_data)
+        deltas = score_event_deltas(impacts or {})
+
+        # Payment outcomes: how many payments each month, then which of them are late
+        n_payments = rng.poisson(rates["payments_per_month"], size=(n_paths, months))
+        outcomes = rng.multinomial(n_payments, rates["outcome_probs"])
+        monthly = outcomes @ np.array([deltas[o] for o in PAYMENT_OUTCOMES], dtype=np.float64)
+
+        # Other events, spend-driven ones growing month over month
+        growth = (1 + rates["spend_growth_3m"]) ** (np.arange(1, months + 1) / 3.0)
+        for event, rate in rates["event_rates"].items():
+            if rate <= 0:
+                continue
+            lam = rate * growth if event in SPEND_EVENTS else np.full(months, rate)
+            monthly += rng.poisson(lam, size=(n_paths, months)) * deltas[event]
+
+        # Walk the paths, clamping to the score range every month
+        scores = np.full(n_paths, float(current_score))
+        bands = {}
+        for m in range(months):
+            scores = np.clip(scores + monthly[:, m], 300, 900)
+            if m + 1 in horizons:
+                values = np.percentile(scores, PROJECTION_PERCENTILES)
+                band = {f"p{p}": int(round(v)) for p, v in zip(PROJECTION_PERCENTILES, values)}
+                band["mean"] = int(round(scores.mean()))
+                bands[str(m + 1)] = band
+
+        return {
+            "current_score": current_score,
+            "paths": n_paths,
+            "seed": seed,
+            "horizons": bands
+        }
+
+# --- COHORT ANALYTICS ---
+
+# Cohorts users are ranked within: each field alone, plus employment type x region
+COHORT_DIMENSIONS = (("region",), ("employment_type",), ("scenario_title",), ("employment_type", "region"))
+COHORT_HISTOGRAM_BUCKET = 50
+
+class CohortIndex:
+    """
+    Sorted score arrays and histograms for every cohort (all users and each
+    value of the COHORT_DIMENSIONS), updated incrementally when a user's
+    score changes. Percentile rank and distribution queries are bisects,
+    O(log n) in the cohort size.
+    """
+    def __init__(self, dimensions=COHORT_DIMENSIONS):
+        self.dimensions = dimensions
+        self._members = {}
+        self._sorted = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def cohorts_for(self, user_data):
+        cohorts = [("all",)]
+        for fields in self.dimensions:
+            values = [user_data.get(field) for field in fields]
+            if all(values):
+                cohorts.append(("+".join(fields), "/".join(str(v) for v in values)))
+        return cohorts
+
+    @staticmethod
+    def bucket(score):
+        return (min(max(score, 300), 899) - 300) // COHORT_HISTOGRAM_BUCKET
+
+    def update(self, username, user_data, score):
+        cohorts = self.cohorts_for(user_data)
+        with self._lock:
+            previous = self._members.get(username)
+            if previous == (score, cohorts):
+                return
+            if previous:
+                self._remove(*previous)
+            for cohort in cohorts:
+                bisect.insort(self._sorted.setdefault(cohort, []), score)
+                histogram = self._histograms.setdefault(cohort, [0] * (600 // COHORT_HISTOGRAM_BUCKET))
+                histogram[self.bucket(score)] += 1
+            self._members[username] = (score, cohorts)
+
+    def _remove(self, score, cohorts):
+        for cohort in cohorts:
+            scores = self._sorted[cohort]
+            del scores[bisect.bisect_left(scores, score)]
+            self._histograms[cohort][self.bucket(score)] -= 1
+
+    def percentile_rank(self, cohort, score):
+        """Share of the cohort scoring below `score` (ties count half), 0-100."""
+        with self._lock:
+            scores = self._sorted.get(cohort, [])
+            if not scores:
+                return None
+            below = bisect.bisect_left(scores, score)
+            ties = bisect.bisect_right(scores, score) - below
+            return round(100.0 * (below + 0.5 * ties) / len(scores), 1)
+
+    def distribution(self, cohort):
+        with self._lock:
+            scores = self._sorted.get(cohort, [])
+            if not scores:
+                return None
+            n = len(scores)
+            return {
+                "cohort": cohort_label(cohort),
+                "count": n,
+                "min": scores[0],
+                "p25": scores[(n - 1) // 4],
+                "median": scores[(n - 1) // 2],
+                "p75": scores[(3 * (n - 1)) // 4],
+                "max": scores[-1],
+                "histogram": [
+                    {"range": f"{300 + i * COHORT_HISTOGRAM_BUCKET}-{299 + (i + 1) * COHORT_HISTOGRAM_BUCKET}", "count": count}
+                    for i, count in enumerate(self._histograms[cohort])
+                ]
+            }
+
+    def describe_user(self, username):
+        """Where the user stands in each of their cohorts."""
+        with self._lock:
+            member = self._members.get(username)
+        if member is None:
+            return None
+        score, cohorts = member
+        ranks = []
+        for cohort in cohorts:
+            percentile = self.percentile_rank(cohort, score)
+            ranks.append({
+                "cohort": cohort_label(cohort),
+                "size": len(self._sorted.get(cohort, [])),
+                "percentile": percentile,
+                "top_percent": round(100 - percentile, 1)
+            })
+        return {"score": score, "cohorts": ranks}
+
+def cohort_label(cohort):
+    if cohort == ("all",):
+        return "All borrowers"
+    return f"{cohort[1].replace('/', ' ')} borrowers"
+
+def cohort_key(dimension, value):
+    """Parses ?dimension=employment_type+region&value=salaried/metro style queries."""
+    if not dimension or dimension == "all":
+        return ("all",)
+    return (dimension, value)
+
+def snapshot_score(user):
+    """
+    The user's score with default impacts, memoized per version. This is the
+    one basis cohorts are ranked on: it needs no LLM call, so every write
+    path (startup, /pay, ingest, precompute) can keep the index current with it.
+    """
+    return user.derived('score', CreditCalculationAgent.calculate)
+
+COHORTS = CohortIndex()
+for _username, _user in USER_DATA.items():
+    COHORTS.update(_username, _user, snapshot_score(_user))
+
+# --- CHANGE FEED ---
+# Per-user server-sent events carrying only what changed, so clients can
+# patch the dashboard instead of re-fetching it after every write.
+
+FEED_FIELDS = ("debt", "current_balance", "savings_balance", "utilization", "current_goal", "goal_amount", "goal_plan")
+FEED_BUFFER_SIZE = 256
+FEED_HEARTBEAT_SECONDS = 15.0
+
+def user_changes(old, new):
+    """The fields, score and alerts that differ between two snapshots of a user."""
+    changes = {field: new.get(field) for field in FEED_FIELDS if old.get(field) != new.get(field)}
+    if snapshot_score(old) != snapshot_score(new):
+        changes['score'] = snapshot_score(new)
+    old_transactions = old.get('transactions', ())
+    if new.get('transactions', ()) is not old_transactions:
+        # Transactions are shared between versions, so the added ones are those not present before
+        known = {id(tx) for tx in old_transactions}
+        added = [tx for tx in new.get('transactions', ()) if id(tx) not in known]
+        if added:
+            changes['new_transactions'] = added
+            alerts = [alert for tx in added for _, alert in ALERT_ENGINE.evaluate(tx)]
+            if alerts:
+                changes['new_alerts'] = alerts
+    return changes
+
+class ChangeFeed:
+    """
+    Keeps the last FEED_BUFFER_SIZE change events of each user in a ring
+    buffer. Every event is encoded as SSE bytes once, at publish time, and
+    each subscriber only holds a cursor into the shared buffer. Thread
+    subscribers (WSGI) block on a per-user Condition; asyncio subscribers
+    (ASGI) are woken on their own loop. Events older than the newest one
+    published for the user are dropped, so versions never go backwards.
+    """
+    def __init__(self, buffer_size=FEED_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._feeds = {}
+
+    def _feed(self, username, base_version=None):
+        feed = self._feeds.get(username)
+        if feed is None:
+            feed = self._feeds.setdefault(username, {
+                "events": deque(maxlen=self.buffer_size),
+                "seq": 0,
+                # Changes before base_version, or evicted from the buffer, cannot be replayed
+                "base_version": get_user_version(username) if base_version is None else base_version,
+                "last_version": -1,
+                "evicted_seq": 0,
+                "evicted_version": -1,
+                "cond": threading.Condition(self._lock),
+                "async_waiters": set()
+            })
+        return feed
+
+    def publish(self, username, version, kind, changes, after_version=None):
+        """
+        Appends an event for snapshot `version`. `after_version` is the version
+        the changes are relative to; a feed created by this event starts there.
+        """
+        if not changes:
+            return
+        body = sse_event(kind, {"version": version, "changes": changes})
+        with self._lock:
+            feed = self._feed(username, version if after_version is None else after_version)
+            if version < feed["last_version"]:
+                # Computed from a snapshot that has since been superseded
+                return
+            feed["last_version"] = version
+            feed["seq"] += 1
+            seq = feed["seq"]
+            if len(feed["events"]) == self.buffer_size:
+                feed["evicted_seq"], feed["evicted_version"] = feed["events"][0][:2]
+            feed["events"].append((seq, version, b"id: %d\n" % seq + body))
+            feed["cond"].notify_all()
+            waiters = list(feed["async_waiters"])
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def events_after(self, username, seq=None, version=None):
+        """
+        Returns (events, cursor, reset) for a subscriber resuming after event
+        `seq`, or after snapshot `version` when no event id is known. `reset`
+        means events were dropped from the buffer and the client must re-fetch.
+        """
+        with self._lock:
+            return self._events_after(self._feed(username), seq, version)
+
+    def _events_after(self, feed, seq, version):
+        events = feed["events"]
+        if seq is None and version is None:
+            return [], feed["seq"], False
+        if seq is not None:
+            # An id from before a restart (or another container) is also unusable
+            pending = [e for e in events if e[0] > seq]
+            reset = seq < feed["evicted_seq"] or seq > feed["seq"]
+        else:
+            pending = [e for e in events if e[1] > version]
+            reset = version < feed["base_version"] or version < feed["evicted_version"]
+        return [e[2] for e in pending], feed["seq"], reset
+
+    def wait(self, username, seq, timeout=FEED_HEARTBEAT_SECONDS):
+        """Blocks until there are events after `seq` or the timeout passes."""
+        with self._lock:
+            feed = self._feed(username)
+            feed["cond"].wait_for(lambda: feed["seq"] > seq, timeout)
+            return self._events_after(feed, seq, None)
+
+    async def wait_async(self, username, seq, timeout=FEED_HEARTBEAT_SECONDS):
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._lock:
+            feed = self._feed(username)
+            if feed["seq"] > seq:
+                return self._events_after(feed, seq, None)
+            feed["async_waiters"].add(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                feed["async_waiters"].discard(waiter)
+        return self.events_after(username, seq)
+
+    def open_stream(self, username, seq=None, version=None):
+        """The first chunks for a new subscriber and the cursor to continue from."""
+        events, cursor, reset = self.events_after(username, seq, version)
+        if reset or (seq is None and version is None):
+            # Nothing to replay: tell the client which version its dashboard should be at
+            return [sse_event("reset" if reset else "hello", {"version": get_user_version(username)})], cursor
+        return events, cursor
+
+    def stream(self, username, seq=None, version=None):
+        chunks, cursor = self.open_stream(username, seq, version)
+        yield b"".join(chunks)
+        while True:
+            events, cursor, reset = self.wait(username, cursor)
+            yield self._chunk(username, events, reset)
+
+    async def stream_async(self, username, seq=None, version=None):
+        chunks, cursor = self.open_stream(username, seq, version)
+        yield b"".join(chunks)
+        while True:
+            events, cursor, reset = await self.wait_async(username, cursor)
+            yield self._chunk(username, events, reset)
+
+    @staticmethod
+    def _chunk(username, events, reset):
+        if reset:
+            # The subscriber fell further behind than the buffer holds
+            return sse_event("reset", {"version": get_user_version(username)})
+        return b"".join(events) if events else b": keep-alive\n\n"
+
+def sse_event(kind, payload):
+    return b"event: %s\ndata: %s\n\n" % (kind.encode(), json_dumps(payload))
+
+# Keep proxies from buffering or caching the stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def feed_cursor(args, headers):
+    """(event id, version) to resume from: Last-Event-ID (header or query) or ?since_version=."""
+    seq = headers.get('Last-Event-ID') or args.get('last_event_id')
+    version = args.get('since_version')
+    return (int(seq) if seq not in (None, "") else None,
+            int(version) if version not in (None, "") else None)
+
+def core_changes(previous, result):
+    """The dashboard-core sections that differ from the previously materialized result."""
+    previous = previous["result"] if previous else {}
+    return {section: result[key] for section, key in (("payment_limits", "payment_limits"), ("score_projection", "projection"), ("analysis", "analysis"))
+            if previous.get(key) != result[key]}
+
+CHANGE_FEED = ChangeFeed()
+
+# --- REQUEST COALESCING ---
+
+class TooManyRequests(Exception):
+    """Raised when admission control sheds a request."""
+    pass
+
+class _InFlightCall:
+    """One coalesced computation, led by a thread (do) or an event-loop task (do_async)."""
+    def __init__(self, scope=None):
+        self.scope = scope
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.async_waiters = []
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical work keyed by (username, version, route).
+    The first caller runs the computation; callers arriving while it is in
+    flight wait for it and receive the same result. Thread callers (do) and
+    event-loop callers (do_async) share one in-flight map, so either kind
+    can wait on work led by the other.
+
+    Admission control per user:
+    - at most `max_inflight_per_user` distinct computations run at once;
+      further callers queue for up to `queue_timeout` seconds, then are shed.
+    - at most `max_waiters_per_key` duplicate callers wait on one computation;
+      the excess is shed immediately.
+    A caller joining work led at a lower LLM priority (e.g. a request joining
+    a background precompute) promotes that work to the caller's priority.
+    """
+    def __init__(self, max_inflight_per_user=2, max_waiters_per_key=16, queue_timeout=30, wait_timeout=120):
+        self.max_inflight_per_user = max_inflight_per_user
+        self.max_waiters_per_key = max_waiters_per_key
+        self.queue_timeout = queue_timeout
+        self.wait_timeout = wait_timeout
+        self._calls = {}
+        self._inflight = {}
+        self._cond = threading.Condition()
+
+    def _join_or_lead(self, key):
+        """Under the lock: (call, is_leader), or (None, False) when the user has no free slot."""
+        username = key[0]
+        call = self._calls.get(key)
+        if call is not None:
+            if call.waiters >= self.max_waiters_per_key:
+                raise TooManyRequests("Too many identical requests in flight. Please retry shortly.")
+            call.waiters += 1
+            if call.scope is not None:
+                LLM_SCHEDULER.promote(call.scope, current_llm_priority())
+            return call, False
+        if self._inflight.get(username, 0) < self.max_inflight_per_user:
+            call = _InFlightCall(_llm_priority.get())
+            self._calls[key] = call
+            self._inflight[username] = self._inflight.get(username, 0) + 1
+            return call, True
+        return None, False
+
+    def _finish(self, key, call, result=None, error=None):
+        username = key[0]
+        with self._cond:
+            del self._calls[key]
+            self._inflight[username] -= 1
+            if not self._inflight[username]:
+                del self._inflight[username]
+            call.result, call.error = result, error
+            call.done.set()
+            async_waiters, call.async_waiters = call.async_waiters, []
+            self._cond.notify_all()
+        for loop, future in async_waiters:
+            loop.call_soon_threadsafe(lambda future=future: future.done() or future.set_result(None))
+
+    def do(self, key, fn):
+        deadline = time.monotonic() + self.queue_timeout
+        with self._cond:
+            while True:
+                call, leader = self._join_or_lead(key)
+                if call is not None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TooManyRequests("Too many concurrent requests for this user. Please retry shortly.")
+                self._cond.wait(timeout=remaining)
+
+        if leader:
+            try:
+                result = fn()
+            except BaseException as e:
+                self._finish(key, call, error=e)
+                if not isinstance(e, Exception):
+                    raise
+            else:
+                self._finish(key, call, result=result)
+        elif not call.done.wait(timeout=self.wait_timeout):
+            raise TooManyRequests("Timed out waiting for an identical request to finish.")
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    async def do_async(self, key, coro_fn):
+        """
+        Event-loop variant of do(). The leader runs coro_fn in a task; waiters
+        await a future resolved when the call finishes, whoever leads it.
+        Queued callers poll for a free slot instead of blocking the loop.
+        """
+        deadline = time.monotonic() + self.queue_timeout
+        while True:
+            with self._cond:
+                call, leader = self._join_or_lead(key)
+                if call is not None and not leader:
+                    finished = asyncio.get_running_loop().create_future()
+                    if call.done.is_set():
+                        finished.set_result(None)
+                    else:
+                        call.async_waiters.append((asyncio.get_running_loop(), finished))
+            if call is not None:
+                break
+            if time.monotonic() >= deadline:
+                raise TooManyRequests("Too many concurrent requests for this user. Please retry shortly.")
+            await asyncio.sleep(0.05)
+
+        if leader:
+            # Shielded so one cancelled caller does not cancel everyone's work
+            await asyncio.shield(asyncio.ensure_future(self._lead_async(key, call, coro_fn)))
+        else:
+            try:
+                await asyncio.wait_for(finished, self.wait_timeout)
+            except asyncio.TimeoutError:
+                raise TooManyRequests("Timed out waiting for an identical request to finish.")
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    async def _lead_async(self, key, call, coro_fn):
+        try:
+            result = await coro_fn()
+        except BaseException as e:
+            self._finish(key, call, error=e)
+            if not isinstance(e, Exception):
+                raise
+        else:
+            self._finish(key, call, result=result)
+
+COALESCER = SingleFlight()
+
+# --- BACKGROUND JOBS ---
+# Slow LLM-backed writes can run as jobs: the request enqueues the work,
+# returns a job id at once, and the client polls /jobs/<id> for the result.
+
+JOB_QUEUE_SIZE = 200
+JOB_WORKERS = 4
+JOB_RETENTION_SECONDS = 3600
+JOB_MAX_RETAINED = 5000
+
+class JobQueue:
+    """
+    A bounded queue drained by a small worker pool. Submitting the same key
+    while a job for it is queued or running returns that job instead of a
+    new one. A full queue raises TooManyRequests. Finished jobs are kept for
+    JOB_RETENTION_SECONDS after they finish (at most JOB_MAX_RETAINED of them).
+    """
+    def __init__(self, max_queue=JOB_QUEUE_SIZE, workers=JOB_WORKERS):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.workers = workers
+        self._jobs = OrderedDict()
+        # Finished job ids in the order they finished
+        self._finished = deque()
+        self._active = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._work, name=f"jobs-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, kind, username, fn, key=None):
+        """Queues fn() and returns the job record (a copy)."""
+        self.start()
+        with self._lock:
+            self._expire()
+            if key is not None and key in self._active:
+                return dict(self._jobs[self._active[key]])
+            job = {
+                "job_id": uuid.uuid4().hex,
+                "kind": kind,
+                "username": username,
+                "state": "queued",
+                "created_at": time.time(),
+                "finished_at": None,
+                "result": None,
+                "error": None
+            }
+            try:
+                self.queue.put_nowait((job["job_id"], key, fn))
+            except queue.Full:
+                raise TooManyRequests("Too many background jobs queued. Please retry shortly.")
+            self._jobs[job["job_id"]] = job
+            if key is not None:
+                self._active[key] = job["job_id"]
+            return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _expire(self):
+        # Retention counts from when a job finished, so a long-queued job is still pollable afterwards
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        while self._finished:
+            job = self._jobs[self._finished[0]]
+            if len(self._jobs) <= JOB_MAX_RETAINED and job["finished_at"] >= cutoff:
+                break
+            del self._jobs[self._finished.popleft()]
+
+    def _work(self):
+        while True:
+            job_id, key, fn = self.queue.get()
+            self._update(job_id, state="running")
+            try:
+                self._update(job_id, state="done", result=fn(), finished_at=time.time())
+            except Exception as e:
+                print(f"Job Error ({job_id}): {e}")
+                self._update(job_id, state="failed", error=str(e), finished_at=time.time())
+            finally:
+                with self._lock:
+                    if key is not None and self._active.get(key) == job_id:
+                        del self._active[key]
+                self.queue.task_done()
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+                if fields.get("finished_at") is not None:
+                    self._finished.append(job_id)
+
+JOBS = JobQueue()
+
+# --- PRECOMPUTE SCHEDULER ---
+
+def compute_dashboard_core(user_data):
+    """
+    Runs the LLM-backed part of the dashboard for a user:
+    dynamic impacts, score, Prediction Agent analysis and payment limits.
+    """
+    # 1. Calculate Preliminary Score (Standard Logic)
+    prelim_score = CreditCalculationAgent.calculate(user_data)
+
+    # 2. Get Dynamic Impacts based on Preliminary Score
+    impacts = ScoreImpactAgent.get_dynamic_impacts(user_data, prelim_score)
+
+    # 3. Recalculate Score with Dynamic Impacts
+    score = CreditCalculationAgent.calculate(user_data, impacts)
+    scored_user = dict(user_data, score=score)
+
+    # 4. Score Projection + Prediction Agent
+    projection = ScoreProjectionEngine.project(user_data, score, impacts)
+    analysis = PredictionAgent.analyze(scored_user, score, projection)
+
+    # 5. Payment Limits (Limit Generator Agent)
+    limits = LimitGeneratorAgent.generate_limits(scored_user)
+
+    return {
+        "impacts": impacts,
+        "score": score,
+        "analysis": analysis,
+        "projection": projection,
+        "payment_limits": limits
+    }
+
+async def compute_dashboard_core_async(user_data):
+    """compute_dashboard_core with non-blocking LLM calls; analysis and limits run concurrently."""
+    prelim_score = CreditCalculationAgent.calculate(user_data)
+    impacts = await ScoreImpactAgent.get_dynamic_impacts_async(user_data, prelim_score)
+    score = CreditCalculationAgent.calculate(user_data, impacts)
+    scored_user = dict(user_data, score=score)
+
+    projection = ScoreProjectionEngine.project(user_data, score, impacts)
+    analysis, limits = await asyncio.gather(
+        PredictionAgent.analyze_async(scored_user, score, projection),
+        LimitGeneratorAgent.generate_limits_async(scored_user)
+    )
+
+    return {
+        "impacts": impacts,
+        "score": score,
+        "analysis": analysis,
+        "projection": projection,
+        "payment_limits": limits
+    }
+
+# Precompute runs PRECOMPUTE_LEAD_HOURS before the 09:00 salary-day visit,
+# and visits spread over the rest of that day; the TTL covers both, so an
+# entry computed ahead of time is still "fresh" for every salary-day visitor
+# and no refresh is pushed into the peak.
+PRECOMPUTE_LEAD_HOURS = 12
+VISIT_WINDOW_HOURS = 15
+MATERIALIZED_TTL_SECONDS = (PRECOMPUTE_LEAD_HOURS + VISIT_WINDOW_HOURS) * 3600
+
+class MaterializedStore:
+    """
+    Holds the precomputed dashboard core per user.
+    Entries are served with stale-while-revalidate semantics:
+    - "fresh": computed from the current user version within the TTL.
+    - "stale": current version but older than the TTL; served while a refresh is queued.
+    - "expired": missing, too old, or computed from an older user version; must be recomputed.
+    """
+    def __init__(self, ttl_seconds=MATERIALIZED_TTL_SECONDS, max_stale_seconds=72 * 3600):
+        self.ttl_seconds = ttl_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        with self._lock:
+            return self._entries.get(username)
+
+    def put(self, username, version, result):
+        entry = {"version": version, "computed_at": time.time(), "result": result}
+        with self._lock:
+            current = self._entries.get(username)
+            # Never let a slow, older computation overwrite a newer one
+            if current and current["version"] > version:
+                return current
+            self._entries[username] = entry
+        return entry
+
+    def state(self, entry, version):
+        if entry is None or entry["version"] != version:
+            return "expired"
+        age = time.time() - entry["computed_at"]
+        if age <= self.ttl_seconds:
+            return "fresh"
+        if age <= self.max_stale_seconds:
+            return "stale"
+        return "expired"
+
+def expected_visit_time(user_data, now=None):
+    """
+    Users mostly log in on salary day, so their next expected visit is the
+    next occurrence of salary_credit_day (at 09:00).
+    """
+    now = now or datetime.now()
+    salary_day = int(user_data.get('salary_credit_day', 1) or 1)
+
+    year, month = now.year, now.month
+    for _ in range(2):
+        day = min(salary_day, calendar.monthrange(year, month)[1])
+        visit = datetime(year, month, day, 9, 0)
+        if visit > now:
+            return visit
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return visit
+
+class PrecomputeScheduler:
+    """
+    Refreshes each user's dashboard core ahead of their expected visit.
+    Jobs sit in a heap ordered by due time (expected visit minus a lead time),
+    so users about to log in are refreshed first. A bounded pool of worker
+    threads drains the heap; their LLM calls run in the scheduler's
+    background class, so they only use capacity interactive traffic leaves.
+    """
+    def __init__(self, store, workers=4, lead_hours=PRECOMPUTE_LEAD_HOURS):
+        self.store = store
+        self.workers = workers
+        self.lead = timedelta(hours=lead_hours)
+        self._heap = []
+        self._due = {}
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"precompute-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def schedule(self, username, due=None):
+        """Queue a refresh at `due` (epoch seconds, default now). Keeps the earliest due time."""
+        due = time.time() if due is None else due
+        with self._cond:
+            if username in self._due and self._due[username] <= due:
+                return
+            self._due[username] = due
+            self._seq += 1
+            heapq.heappush(self._heap, (due, self._seq, username))
+            self._cond.notify()
+
+    def schedule_visit(self, username, user_data, now=None):
+        visit = expected_visit_time(user_data, now)
+        self.schedule(username, max(time.time(), (visit - self.lead).timestamp()))
+
+    def schedule_all(self):
+        for username, user in list(USER_DATA.items()):
+            self.schedule_visit(username, user)
+
+    def pending(self):
+        with self._cond:
+            return len(self._due)
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                # Drop heap entries superseded by an earlier schedule() call
+                while self._heap and self._due.get(self._heap[0][2]) != self._heap[0][0]:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, username = self._heap[0]
+                delay = due - time.time()
+                if delay > 0:
+                    self._cond.wait(timeout=delay)
+                    continue
+                heapq.heappop(self._heap)
+                del self._due[username]
+                return username
+
+    def _worker(self):
+        while True:
+            username = self._next_job()
+            try:
+                self.refresh(username)
+            except Exception as e:
+                print(f"Precompute Error ({username}): {e}")
+
+    def refresh(self, username):
+        user = get_user_by_username(username)
+        if not user:
+            return None
+        try:
+            with llm_priority("background"):
+                entry = materialize_dashboard(username, user)
+        except TooManyRequests:
+            # The user's own requests are already computing it
+            entry = None
+        # Next cycle: refresh again before the following salary day
+        self.schedule_visit(username, user, now=datetime.now() + self.lead)
+        return entry
+
+MATERIALIZED = MaterializedStore()
+PRECOMPUTE = PrecomputeScheduler(MATERIALIZED)
+
+def materialize_dashboard(username, user):
+    """
+    Computes and stores the dashboard core for the user's snapshot version.
+    Concurrent callers (requests or the scheduler) share one computation.
+    """
+    version = user.version
+    return COALESCER.do(
+        (username, version, "dashboard"),
+        lambda: store_dashboard_core(username, user, version, compute_dashboard_core(user))
+    )
+
+def store_dashboard_core(username, user, version, result):
+    COHORTS.update(username, user, snapshot_score(user))
+    previous = MATERIALIZED.get(username)
+    entry = MATERIALIZED.put(username, version, result)
+    if entry["result"] is result:
+        CHANGE_FEED.publish(username, version, "dashboard", core_changes(previous, result))
+    return entry
+
+def get_materialized_dashboard(username, user):
+    """
+    Returns (core, freshness) for the dashboard, serving the materialized
+    store when possible and only computing inline when nothing usable exists.
+    """
+    version = user.version
+    entry = MATERIALIZED.get(username)
+    state = MATERIALIZED.state(entry, version)
+
+    if state == "stale":
+        PRECOMPUTE.schedule(username)
+    if state != "expired":
+        return entry, state
+
+    return materialize_dashboard(username, user), "computed"
+
+async def materialize_dashboard_async(username, user):
+    version = user.version
+
+    async def compute():
+        return store_dashboard_core(username, user, version, await compute_dashboard_core_async(user))
+
+    return await COALESCER.do_async((username, version, "dashboard"), compute)
+
+async def get_materialized_dashboard_async(username, user):
+    version = user.version
+    entry = MATERIALIZED.get(username)
+    state = MATERIALIZED.state(entry, version)
+
+    if state == "stale":
+        PRECOMPUTE.schedule(username)
+    if state != "expired":
+        return entry, state
+
+    return await materialize_dashboard_async(username, user), "computed"
+
+def start_background_services():
+    INGEST.start()
+    JOBS.start()
+    PRECOMPUTE.start()
+    PRECOMPUTE.schedule_all()
+
+# --- WHAT-IF SIMULATOR ---
+
+MAX_SIMULATION_POINTS = 2000
+
+def simulate_payments(user_data, amounts, impacts=None, target="loan"):
+    """
+    Evaluates a grid of candidate payment amounts in one vectorized pass.
+    A payment reduces savings and is applied to one liability, as /pay does:
+    the loan (debt) or the card (the revolving balance, which drives
+    utilization and so the score). Limits come from the Limit Generator's
+    deterministic rules.
+    """
+    amounts = np.asarray(amounts, dtype=np.float64)
+    inputs = LimitGeneratorAgent.limit_inputs(user_data)
+
+    savings = float(inputs['current_savings'])
+    debt = float(inputs['current_debt'])
+    balance = float(user_data.get('current_balance', 0))
+    credit_limit = float(user_data.get('credit_limit', 0))
+
+    remaining_savings = savings - amounts
+    if target == "card":
+        new_debt = np.full(amounts.shape, debt)
+        new_balance = np.maximum(0, balance - amounts)
+        owed = balance
+    else:
+        new_debt = np.maximum(0, debt - amounts)
+        new_balance = np.full(amounts.shape, balance)
+        owed = debt
+    if credit_limit > 0:
+        utilization = new_balance / credit_limit
+    else:
+        utilization = np.full(amounts.shape, float(user_data.get('utilization', 0)))
+    scores = CreditCalculationAgent.calculate_batch(user_data, utilization, impacts)
+
+    # Emergency fund rule: keep max(10% of savings, 1 month of spend) untouched
+    emergency_fund = inputs['emergency_fund']
+    above_emergency_fund = remaining_savings - emergency_fund
+
+    if user_data.get('current_goal'):
+        limits = LimitGeneratorAgent.deterministic_limits(user_data, inputs)
+        safe_limit, max_limit = limits['safe_limit'], limits['max_limit']
+    else:
+        limits = None
+        safe_limit, max_limit = inputs['safe_limit_no_goal'], inputs['max_limit_base']
+
+    # Goal runway: months of goal savings still covered after the emergency fund
+    monthly_savings_needed = inputs['monthly_savings_needed']
+    if monthly_savings_needed > 0:
+        goal_runway = np.round(np.maximum(0, above_emergency_fund) / monthly_savings_needed, 1).tolist()
+    else:
+        goal_runway = None
+
+    return {
+        "amounts": amounts.tolist(),
+        "debt": new_debt.tolist(),
+        "current_balance": new_balance.tolist(),
+        "utilization": np.round(utilization, 4).tolist(),
+        "score": scores.tolist(),
+        "remaining_savings": remaining_savings.tolist(),
+        "above_emergency_fund": above_emergency_fund.tolist(),
+        "keeps_emergency_fund": (above_emergency_fund >= 0).tolist(),
+        "goal_runway_months": goal_runway,
+        "within_safe_limit": (amounts <= safe_limit).tolist(),
+        "within_max_limit": (amounts <= max_limit).tolist(),
+        # Same hard rules the Payment Agent enforces: no overdraft, no overpayment
+        "allowed": ((amounts <= savings) & (amounts <= owed)).tolist(),
+        "emergency_fund": emergency_fund,
+        "safe_limit": safe_limit,
+        "max_limit": max_limit,
+        "months_needed": inputs['months_needed'] if limits else None,
+        "target": target
+    }
+
+def payment_grid(data):
+    """
+    Builds the candidate amounts from a request: either an explicit
+    "amounts" list or a "min"/"max"/"steps" range. The size is checked before
+    anything is allocated, and every ValueError carries a fixed message that
+    is safe to return to the client.
+    """
+    count_message = f"Provide between 1 and {MAX_SIMULATION_POINTS} payment amounts."
+    number_message = "Payment amounts must be non-negative numbers."
+    if data.get("amounts") is not None:
+        raw = data["amounts"]
+        if not isinstance(raw, list) or not 1 <= len(raw) <= MAX_SIMULATION_POINTS:
+            raise ValueError(count_message)
+        try:
+            amounts = np.asarray(raw, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError(number_message)
+        if amounts.ndim != 1:
+            raise ValueError(number_message)
+    else:
+        try:
+            low, high, steps = float(data.get("min", 0)), float(data["max"]), int(data.get("steps", 50))
+        except (KeyError, TypeError, ValueError, OverflowError):
+            raise ValueError("Provide 'amounts' or a 'min'/'max'/'steps' range.")
+        if not 1 <= steps <= MAX_SIMULATION_POINTS:
+            raise ValueError(count_message)
+        amounts = np.linspace(low, high, steps)
+    if not np.all(np.isfinite(amounts)) or np.any(amounts < 0):
+        raise ValueError(number_message)
+    return amounts
+
+# --- ROUTE HELPERS ---
+# Shared by the Flask (WSGI) routes and the async (ASGI) routes.
+
+def build_dashboard_response(username, user, core_entry, freshness):
+    """Assembles the /dashboard payload around the materialized core."""
+    # Plain dict over the frozen snapshot; the snapshot itself is never modified
+    user_response = user.copy()
+    user_response['transactions'] = user.derived('alert_annotated_transactions', lambda u: ALERT_ENGINE.annotate(u.get('transactions', ())))
+    
+    # 1-4. Score, Analysis and Limits (materialized ahead of the visit when possible)
+    core = core_entry["result"]
+    impacts = core["impacts"]
+    score = core["score"]
+    user_response['score'] = score
+    user_response['analysis'] = core["analysis"]
+    user_response['score_projection'] = core["projection"]
+    user_response['monthly_activity'] = MONTH_BUCKETS.for_user(username)
+    # Cohorts are ranked on the default-impact score (see snapshot_score), which can
+    # differ from the score above, so only the labelled ranks are shown here
+    cohort = COHORTS.describe_user(username)
+    user_response['cohort'] = {"basis": "default_impacts", "cohorts": cohort["cohorts"]} if cohort else None
+    
+    # 5. Alerting Agent
+    alerts = AlertingAgent.check_alerts(user_response)
+    user_response['alerts'] = alerts
+    
+    # 6. Chart History
+    history = generate_chart_history(user_response, score, impacts)
+    user_response['history'] = history
+    
+    # 5. Score Movements (Why it changed)
+    movements = explain_score_movements(user_response, history)
+    user_response['score_history'] = {"score_movements": movements}
+    
+    # 6. Financial Plans (On Demand, but we can set null here)
+    user_response['financial_plans'] = None
+    
+    # 7. Payment Limits (Limit Generator Agent)
+    user_response['payment_limits'] = core["payment_limits"]
+    
+    # Remove yearly_analysis as it is removed
+    user_response['yearly_analysis'] = None
+
+    return {
+        "status": "success", 
+        "data": [user_response], 
+        "meta": {
+            "agent_provider": "Nebius Llama-3.3",
+            "freshness": freshness,
+            "computed_at": core_entry["computed_at"],
+            "version": user.version
+        }
+    }
+
+# Dashboard sections that only change with the user version, and those that
+# also depend on the materialized core
+DASHBOARD_USER_SECTIONS = {"transactions", "monthly_activity"}
+DASHBOARD_CORE_SECTIONS = {"analysis", "score_projection", "payment_limits", "alerts", "history", "score_history"}
+
+def encode_dashboard_response(username, payload, core_entry):
+    """
+    JSON bytes for a dashboard payload. Large sections are served from
+    pre-encoded bytes while their source is unchanged.
+    """
+    version = payload["meta"]["version"]
+    user_fields = []
+    for key, value in payload["data"][0].items():
+        if key in DASHBOARD_USER_SECTIONS:
+            encoded = ENCODED_SECTIONS.encode((username, key), version, value)
+        elif key in DASHBOARD_CORE_SECTIONS:
+            encoded = ENCODED_SECTIONS.encode((username, key), (version, core_entry["computed_at"]), value)
+        else:
+            encoded = json_dumps(value)
+        user_fields.append((key, encoded))
+
+    return encode_object([
+        ("status", json_dumps(payload["status"])),
+        ("data", b"[" + encode_object(user_fields) + b"]"),
+        ("meta", json_dumps(payload["meta"]))
+    ])
+
+# What a payment pays down: the loan (debt) or the card (current_balance).
+# A payment goes to exactly one of them, as in apply_transaction.
+PAYMENT_TARGETS = {"loan": "debt", "card": "current_balance"}
+
+def apply_payment_evaluation(username, amount, evaluation, target="loan"):
+    """Applies an approved payment in memory. Returns (payload, status); the caller persists."""
+    if evaluation.get("approved"):
+        field = PAYMENT_TARGETS[target]
+
+        def pay(draft):
+            # Deduct from savings (in memory)
+            draft['savings_balance'] = evaluation.get("remaining_balance", draft['savings_balance'] - amount)
+
+            # and from the target liability
+            # Requirement: "make payment should be able to correct"
+            # (utilization is re-derived only if the card balance changed)
+            if field in draft:
+                draft[field] = max(0, draft[field] - amount)
+        user = update_user(username, pay)
+        COHORTS.update(username, user, snapshot_score(user))
+        # Re-materialize so the new limits and analysis reach the change feed
+        PRECOMPUTE.schedule(username)
+        
+        return {
+            "status": "success", 
+            "message": f"Payment of ${amount} processed successfully. {evaluation.get('reason')}",
+            "new_balance": user['savings_balance'],
+            "new_debt": user.get('debt', 0),
+            "new_card_balance": user.get('current_balance', 0),
+            "target": target
+        }, 200
+    else:
+        return {
+            "status": "error", 
+            "message": f"Payment Rejected: {evaluation.get('reason')}"
+        }, 400
+
+def store_goal(username, goal, goal_amount, plan):
+    # Save goal and amount to user data
+    user = update_user(username, lambda draft: draft.update(current_goal=goal, goal_amount=goal_amount, goal_plan=plan))
+    PRECOMPUTE.schedule(username)
+    return user
+
+def set_user_goal(username, goal, goal_amount):
+    """Generates the goal plan and persists it with the goal. Returns the plan."""
+    user = ensure_score(get_user_by_username(username))
+    plan = GoalSettingAgent.generate_goal_plan(user, goal)
+    store_goal(username, goal, goal_amount, plan)
+    save_user_data()
+    return plan
+
+def generate_user_plans(username):
+    user = get_user_by_username(username)
+
+    # Identical concurrent requests (double-fires, several tabs) share one LLM call
+    def compute_plans():
+        score = CreditCalculationAgent.calculate(user)
+        return FinancialPlanAgent.generate_plans(user, score)
+
+    return COALESCER.do((username, user.version, "generate_plan"), compute_plans)
+
+def goal_job_key(username, goal, goal_amount):
+    # Request values may be any JSON; their encoding is hashable
+    return (username, "set_goal", json_dumps([goal, goal_amount]))
+
+def wants_job(data, args):
+    """Clients opt into job mode with {"async": true} or ?async=1."""
+    return data.get("async") is True or args.get("async") in ("1", "true")
+
+def job_accepted(job):
+    return {"status": "accepted", "job_id": job["job_id"], "state": job["state"], "result_url": f"/jobs/{job['job_id']}"}, 202
+
+def job_response(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return {"status": "error", "message": "Job not found"}, 404
+    return {"status": "success", "data": job}, 200
+
+def simulate_response(data):
+    """/simulate: the what-if curve for a grid of payment amounts. Returns (payload, status)."""
+    username = data.get("username")
+    user = get_user_by_username(username)
+    if not user:
+        return {"status": "error", "message": "User not found"}, 404
+
+    target = data.get("target", "loan")
+    if target not in PAYMENT_TARGETS:
+        return {"status": "error", "message": "target must be 'loan' or 'card'"}, 400
+    try:
+        amounts = payment_grid(data)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}, 400
+
+    # Score with the same dynamic impacts as the dashboard when they are current
+    entry = MATERIALIZED.get(username)
+    impacts = entry["result"]["impacts"] if MATERIALIZED.state(entry, user.version) != "expired" else None
+
+    start = time.perf_counter()
+    curve = simulate_payments(user, amounts, impacts, target)
+    curve["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return {"status": "success", "data": curve}, 200
+
+def cohort_response(args):
+    """
+    /cohort?user=<username> ranks a user within their cohorts;
+    /cohort?dimension=<field>&value=<value> returns a cohort's distribution.
+    """
+    username = args.get('user')
+    if username:
+        if not get_user_by_username(username):
+            return {"status": "error", "message": "User not found"}, 404
+        return {"status": "success", "data": COHORTS.describe_user(username)}, 200
+
+    distribution = COHORTS.distribution(cohort_key(args.get('dimension'), args.get('value')))
+    if distribution is None:
+        return {"status": "error", "message": "Unknown cohort"}, 404
+    return {"status": "success", "data": distribution}, 200
+
+def check_login(username, password):
+    user = get_user_by_username(username)
+    return bool(user) and user['password'] == password
+
 # --- API ENDPOINTS ---
 
+@web_app.errorhandler(TooManyRequests)
+def too_many_requests(e):
+    return jsonify({"status": "error", "message": str(e)}), 429
+
 @web_app.route('/login', methods=['POST'])
 def login():
     data = request.json
     username = data.get("username")
     password = data.get("password")
     
-    user = get_user_by_username(username)
-    
-    if user and user['password'] == password:
+    if check_login(username, password):
         return jsonify({"status": "success", "user_id": username, "token": f"token_{username}"})
     
     return jsonify({"status": "error", "message": "Invalid credentials"}), 401
@@ -839,50 +3137,9 @@ def get_dashboard_data():
         if not user:
             return jsonify({"status": "error", "message": "User not found"}), 404
             
-        # Clone user to avoid modifying global state
-        user_response = user.copy()
-        
-        # 1. Calculate Preliminary Score (Standard Logic)
-        prelim_score = CreditCalculationAgent.calculate(user_response)
-        
-        # 2. Get Dynamic Impacts based on Preliminary Score
-        impacts = ScoreImpactAgent.get_dynamic_impacts(user_response, prelim_score)
-        
-        # 3. Recalculate Score with Dynamic Impacts
-        score = CreditCalculationAgent.calculate(user_response, impacts)
-        user_response['score'] = score
-        
-        # 4. Prediction Agent
-        prediction = PredictionAgent.analyze(user_response, score)
-        user_response['analysis'] = prediction
-        
-        # 5. Alerting Agent
-        alerts = AlertingAgent.check_alerts(user_response)
-        user_response['alerts'] = alerts
-        
-        # 6. Chart History
-        history = generate_chart_history(user_response, score, impacts)
-        user_response['history'] = history
-        
-        # 5. Score Movements (Why it changed)
-        movements = explain_score_movements(user_response, history)
-        user_response['score_history'] = {"score_movements": movements}
-        
-        # 6. Financial Plans (On Demand, but we can set null here)
-        user_response['financial_plans'] = None
-        
-        # 7. Payment Limits (Limit Generator Agent)
-        limits = LimitGeneratorAgent.generate_limits(user_response)
-        user_response['payment_limits'] = limits
-        
-        # Remove yearly_analysis as it is removed
-        user_response['yearly_analysis'] = None
-
-        return jsonify({
-            "status": "success", 
-            "data": [user_response], 
-            "meta": {"agent_provider": "Nebius Llama-3.3"}
-        })
+        core_entry, freshness = get_materialized_dashboard(username, user)
+        payload = build_dashboard_response(username, user, core_entry, freshness)
+        return Response(encode_dashboard_response(username, payload, core_entry), mimetype="application/json")
     else:
         return jsonify({"status": "error", "message": "User parameter required"}), 400
 
@@ -892,8 +3149,12 @@ def make_payment():
     username = data.get("username")
     amount = data.get("amount")
     
+    target = data.get("target", "loan")
+    
     if not username or not amount:
         return jsonify({"status": "error", "message": "Missing username or amount"}), 400
+    if target not in PAYMENT_TARGETS:
+        return jsonify({"status": "error", "message": "target must be 'loan' or 'card'"}), 400
         
     user = get_user_by_username(username)
     if not user:
@@ -902,29 +3163,43 @@ def make_payment():
     # Use PaymentAgent to evaluate
     evaluation = PaymentAgent.evaluate_payment(user, amount)
     
-    if evaluation.get("approved"):
-        # Deduct from savings (in memory)
-        user['savings_balance'] = evaluation.get("remaining_balance", user['savings_balance'] - amount)
-        
-        # Also deduct from debt (current_balance)
-        # Requirement: "make payment should be able to correct"
-        if 'debt' in user:
-            user['debt'] = max(0, user['debt'] - amount)
-            
+    payload, status = apply_payment_evaluation(username, amount, evaluation, target)
+    if status == 200:
         # Persist changes
         save_user_data()
-        
-        return jsonify({
-            "status": "success", 
-            "message": f"Payment of ${amount} processed successfully. {evaluation.get('reason')}",
-            "new_balance": user['savings_balance'],
-            "new_debt": user.get('debt', 0)
-        })
-    else:
-        return jsonify({
-            "status": "error", 
-            "message": f"Payment Rejected: {evaluation.get('reason')}"
-        }), 400
+    return jsonify(payload), status
+
+@web_app.route('/ingest', methods=['POST'])
+def ingest():
+    # ?wait=1 returns only once the records are applied and persisted
+    payload, status = submit_ingest_records(iter_ingest_records(), wait=bool(request.args.get('wait')))
+    return jsonify(payload), status
+
+@web_app.route('/simulate', methods=['POST'])
+def simulate():
+    payload, status = simulate_response(request.json or {})
+    return jsonify(payload), status
+
+@web_app.route('/cohort', methods=['GET'])
+def cohort():
+    payload, status = cohort_response(request.args)
+    return jsonify(payload), status
+
+@web_app.route('/changes', methods=['GET'])
+def changes():
+    """Server-sent change events for one user; reconnects resume via Last-Event-ID."""
+    username = request.args.get('user')
+    if not get_user_by_username(username):
+        return jsonify({"status": "error", "message": "User not found"}), 404
+    try:
+        seq, version = feed_cursor(request.args, request.headers)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid resume position"}), 400
+    return Response(CHANGE_FEED.stream(username, seq, version), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+@web_app.route('/metrics/llm', methods=['GET'])
+def llm_metrics():
+    return jsonify({"status": "success", "data": LLM_SCHEDULER.metrics()})
 
 @web_app.route('/generate_plan', methods=['POST'])
 def generate_plan():
@@ -934,9 +3209,13 @@ def generate_plan():
     user = get_user_by_username(username)
     if not user:
         return jsonify({"status": "error", "message": "User not found"}), 404
-        
-    score = CreditCalculationAgent.calculate(user)
-    plans = FinancialPlanAgent.generate_plans(user, score)
+
+    if wants_job(data, request.args):
+        payload, status = job_accepted(JOBS.submit("generate_plan", username, lambda: generate_user_plans(username),
+                                                   key=(username, user.version, "generate_plan")))
+        return jsonify(payload), status
+
+    plans = generate_user_plans(username)
     return jsonify({"status": "success", "data": plans})
 
 @web_app.route('/set_goal', methods=['POST'])
@@ -952,35 +3231,308 @@ def set_goal():
     user = get_user_by_username(username)
     if not user:
         return jsonify({"status": "error", "message": "User not found"}), 404
-        
-    # Ensure score is present
-    if 'score' not in user:
-        user['score'] = CreditCalculationAgent.calculate(user)
-        
-    plan = GoalSettingAgent.generate_goal_plan(user, goal)
-    
-    # Save goal and amount to user data
-    user['current_goal'] = goal
-    user['goal_amount'] = goal_amount
-    user['goal_plan'] = plan
-    save_user_data()
+
+    if wants_job(data, request.args):
+        payload, status = job_accepted(JOBS.submit("set_goal", username, lambda: set_user_goal(username, goal, goal_amount),
+                                                   key=goal_job_key(username, goal, goal_amount)))
+        return jsonify(payload), status
+
+    plan = set_user_goal(username, goal, goal_amount)
     
     return jsonify({"status": "success", "data": plan})
 
+@web_app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    payload, status = job_response(job_id)
+    return jsonify(payload), status
 
-class ChatAgent:
+
+# --- CHAT CONTEXT ---
+
+CHAT_HISTORY_TOKEN_BUDGET = 1200
+CHAT_TRANSACTION_TOKEN_BUDGET = 400
+CHAT_MAX_SESSIONS = 1000
+
+CHAT_MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+CHAT_MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+
+CHAT_KEYWORDS = {
+    "emi": ("EMI_Repayment",),
+    "loan": ("EMI_Repayment", "Loan_Repayment", "Final_Loan_Payment"),
+    "card": ("CC_Full_Payment", "CC_Min_Payment"),
+    "bill": ("CC_Full_Payment", "CC_Min_Payment"),
+    "purchase": ("Large_Purchase", "Normal_Transaction"),
+    "spend": ("Large_Purchase", "Normal_Transaction", "Cash_Advance"),
+    "cash": ("Cash_Advance",),
+    "inquiry": ("Credit_Inquiry",),
+    "inquiries": ("Credit_Inquiry",),
+    "account": ("New_Account_Opened",)
+}
+
+def estimate_tokens(text):
+    # ~4 characters per token for English text on Llama tokenizers
+    return len(text) // 4 + 1
+
+def format_transaction(t):
+    merchant = t.get('merchant') or t.get('type', 'Transaction')
+    category = t.get('category') or t.get('status', '')
+    return f"{t.get('date')}: {merchant} ({category}) - ${t.get('amount')} [{t.get('type')}, {t.get('status')}]"
+
+def select_relevant_transactions(transactions, message, token_budget=CHAT_TRANSACTION_TOKEN_BUDGET):
     """
-    Agent 6: The Assistant.
-    Handles general enquiries and specific questions about user data.
+    Picks the transactions most relevant to the message (types, statuses,
+    months, merchants and amounts it mentions), most recent first, until the
+    token budget is spent.
+    """
+    words = set(re.findall(r"[a-z]+", message.lower()))
+    amounts = {int(n.replace(',', '')) for n in re.findall(r"\d[\d,]{2,}", message)}
+    months = {CHAT_MONTHS[w] for w in words if w in CHAT_MONTHS}
+    types = {tx_type for w in words for tx_type in CHAT_KEYWORDS.get(w, ())}
+    wants_issues = bool(words & {"late", "missed", "miss", "overdue", "default"})
+
+    def relevance(t):
+        score = 0
+        if t.get('type') in types:
+            score += 2
+        if wants_issues and is_missed_status(t.get('status', '')):
+            score += 3
+        if months and int(t.get('date', '0000-00')[5:7] or 0) in months:
+            score += 2
+        if t.get('amount') in amounts:
+            score += 3
+        for field in ('merchant', 'category'):
+            if t.get(field) and words & set(t[field].lower().split()):
+                score += 2
+        return score
+
+    ranked = sorted(transactions, key=lambda t: (relevance(t), t.get('date', '')), reverse=True)
+    selected, used = [], 0
+    for t in ranked:
+        line = format_transaction(t)
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            break
+        selected.append(line)
+        used += cost
+    return selected
+
+class ChatSessionStore:
+    """
+    Conversation memory per (username, session). Each session keeps its most
+    recent turns within a token budget; the least recently used sessions are
+    dropped beyond `max_sessions`.
+    """
+    def __init__(self, token_budget=CHAT_HISTORY_TOKEN_BUDGET, max_sessions=CHAT_MAX_SESSIONS):
+        self.token_budget = token_budget
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def history(self, key):
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                return []
+            self._sessions.move_to_end(key)
+            return [turn["message"] for turn in session["turns"]]
+
+    def append(self, key, user_message, reply):
+        with self._lock:
+            session = self._sessions.setdefault(key, {"turns": deque(), "tokens": 0})
+            self._sessions.move_to_end(key)
+            for role, content in (("user", user_message), ("assistant", reply)):
+                tokens = estimate_tokens(content)
+                session["turns"].append({"message": {"role": role, "content": content}, "tokens": tokens})
+                session["tokens"] += tokens
+            # Forget the oldest turns once over budget
+            while session["tokens"] > self.token_budget and len(session["turns"]) > 2:
+                session["tokens"] -= session["turns"].popleft()["tokens"]
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+CHAT_SESSIONS = ChatSessionStore()
+
+# --- LOCAL TRANSACTION ANSWERS ---
+
+PAYMENT_TYPES = LOAN_PAYMENT_TYPES | CARD_PAYMENT_TYPES
+
+class TransactionIndex:
+    """
+    Inverted index over one user version's transactions: type, status
+    class, month and year map to transaction positions (newest first),
+    plus an amount-sorted list for range lookups.
+    """
+    def __init__(self, transactions):
+        self.transactions = sorted(transactions, key=lambda t: t.get('date', ''), reverse=True)
+        self.by_type = {}
+        self.by_status = {}
+        self.by_month = {}
+        self.by_year = {}
+        for i, t in enumerate(self.transactions):
+            date = t.get('date', '')
+            self.by_type.setdefault(t.get('type'), []).append(i)
+            self.by_status.setdefault(self.status_class(t.get('status', '')), []).append(i)
+            self.by_month.setdefault(date[:7], []).append(i)
+            self.by_year.setdefault(date[:4], []).append(i)
+        self.by_amount = sorted((t.get('amount', 0), i) for i, t in enumerate(self.transactions))
+
+    @staticmethod
+    def status_class(status):
+        if 'missed' in status.lower():
+            return "missed"
+        if 'Late' in status:
+            return "late"
+        return "ok"
+
+    def lookup(self, types=None, statuses=None, month=None, year=None):
+        """Positions matching every given filter, newest first."""
+        sets = []
+        if types is not None:
+            sets.append({i for tx_type in types for i in self.by_type.get(tx_type, [])})
+        if statuses is not None:
+            sets.append({i for status in statuses for i in self.by_status.get(status, [])})
+        if month is not None:
+            sets.append(set(self.by_month.get(month, [])))
+        if year is not None:
+            sets.append(set(self.by_year.get(year, [])))
+        if not sets:
+            return list(range(len(self.transactions)))
+        return sorted(set.intersection(*sets))
+
+    def above(self, amount):
+        start = bisect.bisect_right(self.by_amount, (amount, len(self.transactions)))
+        return sorted(i for _, i in self.by_amount[start:])
+
+    def largest(self):
+        return self.by_amount[-1][1] if self.by_amount else None
+
+class LocalAnswerer:
+    """
+    Answers transaction lookup questions exactly from the index, so only
+    open-ended questions reach the Chat Agent.
     """
+    # Optional trailing period ("in March", "in March 2025", "in 2025", "this year")
+    PERIOD = r"(?: (?:in|for|during|of) (?:(?:%s)(?: \d{4})?|20\d{2})| this year)?" % "|".join(sorted(CHAT_MONTHS, key=len, reverse=True))
+    # Polite lead-ins that do not change the question
+    LEAD_IN = r"^(?:(?:please|hey|hi|can you|could you|tell me|show me|give me|list|show)\s+)+"
+    PAYMENT_NOUNS = {"emi": ["EMI_Repayment"], "loan": LOAN_PAYMENT_TYPES, "card": CARD_PAYMENT_TYPES,
+                     "cc": CARD_PAYMENT_TYPES, "credit card": CARD_PAYMENT_TYPES, "bill": CARD_PAYMENT_TYPES}
+
+    @staticmethod
+    def index_for(user_data):
+        # Memoized on the snapshot itself, so an index always matches the transactions it was built from
+        return user_data.derived('transaction_index', lambda u: TransactionIndex(u.get('transactions', ())))
+
+    @staticmethod
+    def parse_period(text):
+        month = re.search(r"\b(?:in|for|during|of)\s+([a-z]+)(?:\s+(\d{4}))?", text)
+        if month and month.group(1) in CHAT_MONTHS:
+            year = month.group(2) or str(REFERENCE_YEAR)
+            return f"{year}-{CHAT_MONTHS[month.group(1)]:02d}", None
+        year = re.search(r"\b(20\d{2})\b", text)
+        if year:
+            return None, year.group(1)
+        if "this year" in text:
+            return None, str(REFERENCE_YEAR)
+        return None, None
+
+    @staticmethod
+    def describe(t):
+        return f"{t.get('date')}: {t.get('type', '').replace('_', ' ')} of ${t.get('amount', 0):,} ({t.get('status')})"
+
+    @staticmethod
+    def normalize(message):
+        text = re.sub(r"\s+", " ", message.lower().replace("’", "'")).strip().rstrip("?.! ")
+        return re.sub(LocalAnswerer.LEAD_IN, "", text)
+
     @staticmethod
-    def chat(user_data, message):
-        client = OpenAI(
-            base_url="https://api.tokenfactory.nebius.com/v1/",
-            api_key=os.environ.get("NEBIUS_API_KEY")
+    def answer(user_data, message):
+        """
+        Returns {"intent", "response", "transactions"} or None if the question is open-ended.
+        Each intent must match the whole question; anything with extra
+        qualifiers ("... for late fees", "... will a mortgage trigger") goes to the LLM.
+        """
+        text = LocalAnswerer.normalize(message)
+        period_re = LocalAnswerer.PERIOD
+        index = LocalAnswerer.index_for(user_data)
+        txs = index.transactions
+        month, year = LocalAnswerer.parse_period(text)
+        if month:
+            period = f" in {calendar.month_name[int(month[5:])]} {month[:4]}"
+        else:
+            period = f" in {year}" if year else ""
+        describe = LocalAnswerer.describe
+
+        def result(intent, response, positions=()):
+            return {"intent": intent, "response": response, "transactions": [txs[i] for i in positions]}
+
+        if re.fullmatch(r"how many (?:hard )?(?:credit )?inquir(?:y|ies)(?: (?:do i have|have i had|did i have|are there|were there|are on my (?:file|report)))?" + period_re, text):
+            hits = index.lookup(types=["Credit_Inquiry"], month=month, year=year)
+            return result("count_inquiries", f"You have {len(hits)} hard credit {'inquiry' if len(hits) == 1 else 'inquiries'}{period}.", hits)
+
+        missed = (
+            re.fullmatch(r"(?:(?:do i have|have i had|did i have|are there|were there) )?(?:any )?(?:my )?(?:missed|late|overdue)(?: or (?:missed|late))? (payments?|emis?|bills?)" + period_re, text)
+            or re.fullmatch(r"(?:did i|have i)(?: ever)? miss(?:ed)? (?:any|a|an) (payments?|emis?|bills?)" + period_re, text)
         )
+        if missed:
+            types = ["EMI_Repayment"] if missed.group(1).startswith("emi") else None
+            hits = index.lookup(types=types, statuses=["late", "missed"], month=month, year=year)
+            what = "EMI payments" if types else "payments"
+            if not hits:
+                return result("missed_payments", f"No missed or late {what}{period}. Everything was paid on time.")
+            lines = "\n".join(f"- {describe(txs[i])}" for i in hits)
+            return result("missed_payments", f"You have {len(hits)} missed or late {what}{period}:\n{lines}", hits)
+
+        last = re.fullmatch(r"(?:(?:what|when) (?:was|is) |what's |when's )?(?:my |the )?(?:last|latest|most recent|previous) (?:(emi|loan|credit card|card|cc|bill) )?payment" + period_re, text)
+        if last:
+            # Only payments that went through count as "paid"
+            types = LocalAnswerer.PAYMENT_NOUNS.get(last.group(1), PAYMENT_TYPES)
+            hits = index.lookup(types=types, statuses=["ok"], month=month, year=year)
+            if not hits:
+                return result("last_payment", f"I couldn't find any matching payment{period}.")
+            return result("last_payment", f"Your last payment was on {describe(txs[hits[0]])}.", hits[:1])
+
+        if re.fullmatch(r"how much (?:did i|have i|do i) (?:spend|spent)(?: in total| overall| altogether)?" + period_re, text) \
+                or re.fullmatch(r"(?:(?:what (?:was|is)|what's) )?my total (?:spend|spending)" + period_re, text):
+            hits = index.lookup(types=SPEND_TYPES, month=month, year=year)
+            total = sum(txs[i].get('amount', 0) for i in hits)
+            return result("total_spend", f"You spent ${total:,} across {len(hits)} transaction{'' if len(hits) == 1 else 's'}{period}.", hits)
+
+        largest = re.fullmatch(r"(?:(?:what (?:was|is)|what's) )?(?:my |the )?(?:largest|biggest|highest|max|maximum) (transaction|purchase|spend|payment)(?: ever)?" + period_re, text)
+        if largest:
+            noun = largest.group(1)
+            if noun == "transaction" and not (month or year):
+                hits = [] if index.largest() is None else [index.largest()]
+            else:
+                types = {"purchase": SPEND_TYPES, "spend": SPEND_TYPES, "payment": PAYMENT_TYPES}.get(noun)
+                hits = index.lookup(types=types, statuses=["ok"] if noun == "payment" else None, month=month, year=year)
+                hits = [max(hits, key=lambda i: txs[i].get('amount', 0))] if hits else []
+            if not hits:
+                return result("largest_transaction", f"I couldn't find any matching {noun}{period}.")
+            return result("largest_transaction", f"Your largest {noun} was {describe(txs[hits[0]])}.", hits)
+
+        over = re.fullmatch(r"(?:(?:which|what|are there any|do i have any|any) )?(?:my )?(?:all )?(transactions|purchases|payments) (?:over|above|more than|greater than|exceeding) \$?(\d[\d,]*)" + period_re, text)
+        if over:
+            amount = int(over.group(2).replace(',', ''))
+            hits = index.above(amount)
+            types = {"purchases": SPEND_TYPES, "payments": PAYMENT_TYPES}.get(over.group(1))
+            if types is not None or month or year:
+                allowed = set(index.lookup(types=types, month=month, year=year))
+                hits = [i for i in hits if i in allowed]
+            if not hits:
+                return result("transactions_over", f"No {over.group(1)} over ${amount:,}{period}.")
+            lines = "\n".join(f"- {describe(txs[i])}" for i in hits[:10])
+            more = f"\n...and {len(hits) - 10} more." if len(hits) > 10 else ""
+            return result("transactions_over", f"You have {len(hits)} {over.group(1)} over ${amount:,}{period}:\n{lines}{more}", hits)
+
+        return None
 
-        system_prompt = """You are a helpful Banking Assistant Chatbot.
+class ChatAgent:
+    """
+    Agent 6: The Assistant.
+    Handles general enquiries and specific questions about user data.
+    """
+    system_prompt = """You are a helpful Banking Assistant Chatbot.
         You have access to the user's financial data including transactions, loans, and credit score.
         
         Your capabilities:
@@ -992,37 +3544,71 @@ class ChatAgent:
         If the user asks about something you don't have data for, politely say so.
         """
 
-        # Prepare context from user_data
-        transactions_summary = []
-        for t in user_data.get('transactions', [])[:20]: # Last 20 transactions
-            transactions_summary.append(f"{t['date']}: {t['merchant']} ({t['category']}) - ${t['amount']} [{t['type']}]")
-            
-        context = f"""
+    # (username, version) -> user context message, built once per user version
+    _prefix_cache = {}
+    _prefix_lock = threading.Lock()
+
+    @staticmethod
+    def context_prefix(user_data):
+        # The snapshot's own version: a prefix built from an older snapshot must not be filed under a newer one
+        key = (user_data.get('username'), user_data.version, user_data.get('score', 'N/A'))
+        with ChatAgent._prefix_lock:
+            prefix = ChatAgent._prefix_cache.get(key)
+        if prefix is None:
+            prefix = f"""
         User Context:
         - Username: {user_data.get('username')}
         - Current Score: {user_data.get('score', 'N/A')}
         - Income: ${user_data.get('income')}
         - Debt: ${user_data.get('debt')}
         - Savings: ${user_data.get('savings_balance')}
-        - Recent Transactions:
-        {chr(10).join(transactions_summary)}
         """
+            with ChatAgent._prefix_lock:
+                # Older versions of this user can never be asked for again
+                for stale in [k for k in ChatAgent._prefix_cache if k[0] == key[0]]:
+                    del ChatAgent._prefix_cache[stale]
+                ChatAgent._prefix_cache[key] = prefix
+        return prefix
 
-        try:
-            response = client.chat.completions.create(
-                model="meta-llama/Llama-3.3-70B-Instruct-fast",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "system", "content": context},
-                    {"role": "user", "content": message}
-                ],
-                temperature=0.7,
-                max_tokens=500
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"Agent Error (Chat): {e}")
-            return "I apologize, but I'm currently unable to process your request. Please try again later."
+    @staticmethod
+    def build_messages(user_data, message, history):
+        # Static system prompt and user context come first so the provider can
+        # reuse the cached prefix; per-turn content goes last.
+        relevant = select_relevant_transactions(user_data.get('transactions', []), message)
+        return [
+            {"role": "system", "content": ChatAgent.system_prompt},
+            {"role": "system", "content": ChatAgent.context_prefix(user_data)},
+            *history,
+            {"role": "system", "content": "Relevant Transactions:\n" + "\n".join(relevant)},
+            {"role": "user", "content": message}
+        ]
+
+    @staticmethod
+    def chat(user_data, message, session_id=None):
+        return run_llm_call(ChatAgent.chat_call(user_data, message, session_id))
+
+    @staticmethod
+    async def chat_async(user_data, message, session_id=None):
+        return await run_llm_call_async(ChatAgent.chat_call(user_data, message, session_id))
+
+    @staticmethod
+    def chat_call(user_data, message, session_id=None):
+        session_key = (user_data.get('username'), session_id or "default")
+        messages = ChatAgent.build_messages(user_data, message, CHAT_SESSIONS.history(session_key))
+
+        def parse(reply):
+            CHAT_SESSIONS.append(session_key, message, reply)
+            return reply
+
+        return LLMCall(
+            "Chat",
+            username=user_data.get('username'),
+            messages=messages,
+            temperature=0.7,
+            max_tokens=500,
+            parse=parse,
+            fallback=lambda: "I apologize, but I'm currently unable to process your request. Please try again later."
+        )
 
 @web_app.route('/chat', methods=['POST'])
 def chat():
@@ -1038,18 +3624,32 @@ def chat():
         return jsonify({"status": "error", "message": "User not found"}), 404
         
     # Ensure score is calculated if missing (though usually dashboard calls it first)
-    if 'score' not in user:
-        user['score'] = CreditCalculationAgent.calculate(user)
+    user = ensure_score(user)
+        
+    # Lookups answerable exactly from the transactions never reach the LLM
+    local = LocalAnswerer.answer(user, message)
+    if local:
+        CHAT_SESSIONS.append((username, data.get("session_id") or "default"), message, local["response"])
+        return jsonify({
+            "status": "success",
+            "response": local["response"],
+            "source": "local",
+            "intent": local["intent"]
+        })
         
-    response = ChatAgent.chat(user, message)
+    response = ChatAgent.chat(user, message, data.get("session_id"))
     
     return jsonify({
         "status": "success", 
-        "response": response
+        "response": response,
+        "source": "llm"
     })
 
 @web_app.route('/users', methods=['GET'])
 def get_users():
+    return jsonify({"status": "success", "data": list_users()})
+
+def list_users():
     users_list = []
     for u in USER_DATA.values():
         users_list.append({
@@ -1062,14 +3662,515 @@ def get_users():
     except:
         users_list.sort(key=lambda x: x['username'])
         
-    return jsonify({"status": "success", "data": users_list})
+    return users_list
+
+# --- ANALYTICS EXPORT ---
+# Columnar snapshots of users, flattened transactions and computed scores for
+# the risk team, written as Parquet or Arrow IPC files in bounded row groups.
+# `python backend.py export` runs it; see export_analytics.
+
+EXPORT_ROW_GROUP_SIZE = 50000
+EXPORT_MANIFEST = "manifest.json"
+
+# User fields exported as is, by column type (credentials and free text are left out)
+EXPORT_TEXT_FIELDS = ("username", "user_id", "name", "scenario_title", "employment_type", "region", "gender", "current_goal")
+EXPORT_AMOUNT_FIELDS = ("credit_limit", "current_balance", "monthly_spend", "min_payment_due", "emi_amount", "savings_balance",
+                        "cash_advance_amt", "annual_income", "income", "debt", "last_year_tax_paid", "estimated_income",
+                        "goal_amount", "utilization", "spend_growth_3m")
+EXPORT_COUNT_FIELDS = ("num_active_accounts", "num_new_inquiries_6m", "num_missed_payments_12m", "days_past_due",
+                       "late_payment_flag_30d", "payment_history", "salary_credit_day")
+
+def export_schemas():
+    """(users, transactions, score_history) Arrow schemas."""
+    users = pa.schema(
+        [(field, pa.string()) for field in EXPORT_TEXT_FIELDS]
+        + [(field, pa.float64()) for field in EXPORT_AMOUNT_FIELDS]
+        + [(field, pa.int32()) for field in EXPORT_COUNT_FIELDS]
+        + [("score", pa.int32()), ("transaction_count", pa.int32()), ("late_payment_count", pa.int32()),
+           ("content_hash", pa.string()), ("export_id", pa.string()), ("exported_at", pa.timestamp("s"))]
+    )
+    transactions = pa.schema([
+        ("username", pa.string()), ("date", pa.date32()), ("month_offset", pa.int32()), ("type", pa.string()),
+        ("amount", pa.float64()), ("status", pa.string()), ("merchant", pa.string()), ("category", pa.string()),
+        ("is_late", pa.bool_()), ("alert", pa.bool_()), ("export_id", pa.string())
+    ])
+    score_history = pa.schema([
+        ("username", pa.string()), ("month_index", pa.int8()), ("month", pa.string()), ("score", pa.int32()),
+        ("impacts_source", pa.string()), ("export_id", pa.string())
+    ])
+    return users, transactions, score_history
+
+class ColumnarWriter:
+    """
+    Buffers rows for one file and writes them out every `row_group_size`
+    rows, so memory stays bounded however much is exported. The file is
+    written under a temporary name and moved into place on close().
+    """
+    def __init__(self, path, schema, fmt="parquet", row_group_size=EXPORT_ROW_GROUP_SIZE):
+        self.path = path
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.rows = 0
+        self._tmp_path = f"{path}.tmp"
+        self._buffer = []
+        if fmt == "parquet":
+            self._writer = pq.ParquetWriter(self._tmp_path, schema, compression="zstd")
+        else:
+            self._sink = pa.OSFile(self._tmp_path, "wb")
+            self._writer = pa.ipc.new_file(self._sink, schema)
+
+    def add(self, row):
+        self._buffer.append(row)
+        if len(self._buffer) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._writer.write_table(pa.Table.from_pylist(self._buffer, schema=self.schema), self.row_group_size)
+            self.rows += len(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+        if hasattr(self, "_sink"):
+            self._sink.close()
+        os.replace(self._tmp_path, self.path)
+
+def user_content_hash(user):
+    return hashlib.blake2b(json_dumps(user), digest_size=16).hexdigest()
+
+def export_rows(user, export_id, exported_at, content_hash):
+    """(user row, transaction rows, score history rows) for one user snapshot."""
+    username = user['username']
+    score = snapshot_score(user)
+
+    # Score history uses the materialized LLM impacts when they match this version; no LLM calls here
+    entry = MATERIALIZED.get(username)
+    current = MATERIALIZED.state(entry, user.version) != "expired"
+    impacts = entry["result"]["impacts"] if current else {}
+    history = generate_chart_history(user, score, impacts)
+
+    transactions = []
+    for tx in user.get('transactions', ()):
+        late = is_missed_status(tx.get('status', ''))
+        transactions.append({
+            "username": username,
+            "date": datetime.strptime(tx['date'][:10], "%Y-%m-%d").date() if tx.get('date') else None,
+            "month_offset": tx.get('month_offset'),
+            "type": tx.get('type'),
+            "amount": tx.get('amount'),
+            "status": tx.get('status'),
+            "merchant": tx.get('merchant'),
+            "category": tx.get('category'),
+            "is_late": late,
+            "alert": bool(ALERT_ENGINE.evaluate(tx)),
+            "export_id": export_id
+        })
+
+    user_row = {field: user.get(field) for field in EXPORT_TEXT_FIELDS + EXPORT_AMOUNT_FIELDS + EXPORT_COUNT_FIELDS}
+    user_row.update({
+        "score": score,
+        "transaction_count": len(transactions),
+        "late_payment_count": sum(1 for t in transactions if t["is_late"]),
+        "content_hash": content_hash,
+        "export_id": export_id,
+        "exported_at": exported_at
+    })
+    history_rows = [
+        {"username": username, "month_index": i, "month": point["month"], "score": point["score"],
+         "impacts_source": "materialized" if current else "default", "export_id": export_id}
+        for i, point in enumerate(history)
+    ]
+    return user_row, transactions, history_rows
+
+def export_analytics(out_dir="exports", fmt="parquet", full=False, row_group_size=EXPORT_ROW_GROUP_SIZE):
+    """
+    Exports users, transactions and score history to
+    <out_dir>/<export_id>/{users,transactions,score_history}.<ext>.
+
+    Runs are incremental: the manifest in out_dir records a content hash
+    per user, and only users whose data changed since the last run are
+    written (all of them with `full`). Each export holds complete rows for
+    its users, so the latest export containing a user is authoritative.
+    """
+    if pa is None:
+        raise RuntimeError("Exports need pyarrow: pip install pyarrow")
+    if fmt not in ("parquet", "arrow"):
+        raise ValueError("Format must be 'parquet' or 'arrow'")
+
+    manifest_path = os.path.join(out_dir, EXPORT_MANIFEST)
+    manifest = {"exports": [], "users": {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'rb') as f:
+            manifest = json_loads(f.read())
+
+    exported_at = datetime.now().replace(microsecond=0)
+    export_id = f"{exported_at:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+    export_dir = os.path.join(out_dir, export_id)
+    ext = "parquet" if fmt == "parquet" else "arrow"
+
+    users = list(USER_DATA.values())
+    hashes = {user['username']: user_content_hash(user) for user in users}
+    changed = [user for user in users if full or manifest["users"].get(user['username']) != hashes[user['username']]]
+    summary = {"export_id": export_id, "full": full, "users": len(changed), "unchanged": len(users) - len(changed)}
+    if not changed:
+        summary["path"] = None
+        return summary
+
+    os.makedirs(export_dir, exist_ok=True)
+    user_schema, tx_schema, history_schema = export_schemas()
+    writers = {
+        "users": ColumnarWriter(os.path.join(export_dir, f"users.{ext}"), user_schema, fmt, row_group_size),
+        "transactions": ColumnarWriter(os.path.join(export_dir, f"transactions.{ext}"), tx_schema, fmt, row_group_size),
+        "score_history": ColumnarWriter(os.path.join(export_dir, f"score_history.{ext}"), history_schema, fmt, row_group_size)
+    }
+    for user in changed:
+        user_row, transactions, history = export_rows(user, export_id, exported_at, hashes[user['username']])
+        writers["users"].add(user_row)
+        for row in transactions:
+            writers["transactions"].add(row)
+        for row in history:
+            writers["score_history"].add(row)
+    for writer in writers.values():
+        writer.close()
+
+    # Only record the run once every file is in place
+    manifest["users"].update({user['username']: hashes[user['username']] for user in changed})
+    manifest["exports"].append({"export_id": export_id, "full": full, "format": fmt, "users": len(changed)})
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(json_dumps(manifest))
+    os.replace(tmp_path, manifest_path)
+
+    summary.update({"path": export_dir, "rows": {name: writer.rows for name, writer in writers.items()}})
+    return summary
+
+# --- BULK SCORE REPORT ---
+# Portfolio-wide scoring for monthly reporting: `python backend.py score-report`
+# splits the users across a process pool and streams one NDJSON row per user.
+
+SCORE_REPORT_CHUNK_SIZE = 50
+SCORE_REPORT_IMPACTS_CACHE = "score_report_impacts.json"
+
+def score_report_row(user, impacts_mode="stub", cached_impacts=None):
+    """
+    Scores and explains one user the way the dashboard does. Dynamic impacts
+    come from the Score Impact Agent ("live"), from the cache when given,
+    or are skipped in favour of the default weights ("stub").
+    """
+    preliminary = CreditCalculationAgent.calculate(user)
+    if cached_impacts is not None:
+        impacts, source = cached_impacts, "cache"
+    elif impacts_mode == "stub":
+        impacts, source = None, "stub"
+    else:
+        impacts, source = ScoreImpactAgent.get_dynamic_impacts(user, preliminary), "llm"
+
+    score = CreditCalculationAgent.calculate(user, impacts)
+    history = generate_chart_history(user, score, impacts or {})
+    return {
+        "username": user['username'],
+        "content_hash": user_content_hash(user),
+        "preliminary_score": preliminary,
+        "score": score,
+        "impacts": impacts,
+        "impacts_source": source,
+        "history": history,
+        "score_movements": explain_score_movements(user, history),
+        "alerts": AlertingAgent.check_alerts(user)
+    }
+
+def score_report_chunk(usernames, impacts_mode, cached):
+    """
+    Worker entry point. Only usernames cross the process boundary: workers
+    read users from their own USER_DATA (inherited when forked, loaded from
+    the data file otherwise). Raises LookupError if any user is missing, so
+    the report is never silently short.
+    """
+    missing = [username for username in usernames if get_user_by_username(username) is None]
+    if missing:
+        raise LookupError(
+            f"{len(missing)} users not found in worker {os.getpid()} (e.g. {', '.join(missing[:5])}). "
+            "Workers that are not forked only see users saved to the data file; save first or run with workers=1."
+        )
+    return [score_report_row(get_user_by_username(username), impacts_mode, cached.get(username)) for username in usernames]
+
+def run_score_report(out_path, workers=None, impacts_mode="stub", cache_path=SCORE_REPORT_IMPACTS_CACHE,
+                     chunk_size=SCORE_REPORT_CHUNK_SIZE, progress=sys.stderr):
+    """
+    Writes an NDJSON score report for every user to `out_path`, in completion
+    order, reporting progress as chunks finish. impacts_mode is "stub", "live"
+    or "cache"; "cache" reuses impacts from `cache_path` for users whose data
+    is unchanged and calls the LLM (then caches) for the rest.
+    workers=1 runs in-process.
+    """
+    if impacts_mode not in ("stub", "live", "cache"):
+        raise ValueError("impacts_mode must be 'stub', 'live' or 'cache'")
+    usernames = list(USER_DATA)
+    hashes = {username: user_content_hash(USER_DATA[username]) for username in usernames}
+
+    cache = {}
+    if impacts_mode == "cache" and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            cache = json_loads(f.read())
+    cached = {u: entry["impacts"] for u, entry in cache.items() if u in hashes and entry.get("hash") == hashes[u]}
+
+    chunks = [usernames[i:i + chunk_size] for i in range(0, len(usernames), chunk_size)]
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    done = 0
+    last_report = 0.0
+    tmp_path = f"{out_path}.tmp"
+
+    def write_rows(rows, out):
+        nonlocal done, last_report
+        for row in rows:
+            out.write(json_dumps(row) + b"\n")
+            if impacts_mode == "cache" and row["impacts_source"] == "llm":
+                cache[row["username"]] = {"hash": row["content_hash"], "impacts": row["impacts"]}
+        done += len(rows)
+        now = time.perf_counter()
+        if progress and (now - last_report >= 0.5 or done == len(usernames)):
+            last_report = now
+            progress.write(f"Scored {done}/{len(usernames)} users ({done / max(now - start, 1e-9):.0f} users/s)\n")
+            progress.flush()
+
+    try:
+        with open(tmp_path, 'wb') as out:
+            if workers == 1:
+                for chunk in chunks:
+                    write_rows(score_report_chunk(chunk, impacts_mode, cached), out)
+            else:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                    futures = [pool.submit(score_report_chunk, chunk, impacts_mode, {u: cached[u] for u in chunk if u in cached})
+                               for chunk in chunks]
+                    for future in concurrent.futures.as_completed(futures):
+                        write_rows(future.result(), out)
+    except BaseException:
+        # Never leave a partial report behind
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, out_path)
+
+    if impacts_mode == "cache":
+        with open(f"{cache_path}.tmp", 'wb') as f:
+            f.write(json_dumps(cache))
+        os.replace(f"{cache_path}.tmp", cache_path)
+
+    elapsed = time.perf_counter() - start
+    return {"users": done, "workers": workers, "impacts": impacts_mode, "seconds": round(elapsed, 2),
+            "users_per_second": round(done / elapsed, 1) if elapsed else None, "path": out_path}
+
+# --- ASYNC SERVING (ASGI) ---
+# Same routes as the Flask app, but handlers await the LLM instead of pinning
+# a worker thread, so one container can hold many concurrent Nebius calls.
+
+async_web_app = FastAPI()
+async_web_app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+def json_response(payload, status=200):
+    return ASGIResponse(json_dumps(payload), status_code=status, media_type="application/json")
+
+def json_error(message, status):
+    return json_response({"status": "error", "message": message}, status)
+
+async def request_json(req):
+    try:
+        data = await req.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+@async_web_app.exception_handler(TooManyRequests)
+async def async_too_many_requests(req, e):
+    return json_error(str(e), 429)
+
+@async_web_app.post('/login')
+async def async_login(req: ASGIRequest):
+    data = await request_json(req)
+    username = data.get("username")
+    if check_login(username, data.get("password")):
+        return json_response({"status": "success", "user_id": username, "token": f"token_{username}"})
+    return json_error("Invalid credentials", 401)
+
+@async_web_app.get('/dashboard')
+async def async_dashboard(user: str = None):
+    if not user:
+        return json_error("User parameter required", 400)
+    user_data = get_user_by_username(user)
+    if not user_data:
+        return json_error("User not found", 404)
+    core_entry, freshness = await get_materialized_dashboard_async(user, user_data)
+    payload = build_dashboard_response(user, user_data, core_entry, freshness)
+    return ASGIResponse(encode_dashboard_response(user, payload, core_entry), media_type="application/json")
+
+@async_web_app.post('/pay')
+async def async_pay(req: ASGIRequest):
+    data = await request_json(req)
+    username = data.get("username")
+    amount = data.get("amount")
+    target = data.get("target", "loan")
+    if not username or not amount:
+        return json_error("Missing username or amount", 400)
+    if target not in PAYMENT_TARGETS:
+        return json_error("target must be 'loan' or 'card'", 400)
+    user = get_user_by_username(username)
+    if not user:
+        return json_error("User not found", 404)
+
+    evaluation = await PaymentAgent.evaluate_payment_async(user, amount)
+    payload, status = apply_payment_evaluation(username, amount, evaluation, target)
+    if status == 200:
+        await asyncio.to_thread(save_user_data)
+    return json_response(payload, status)
+
+@async_web_app.post('/chat')
+async def async_chat(req: ASGIRequest):
+    data = await request_json(req)
+    username = data.get("username")
+    message = data.get("message")
+    if not username or not message:
+        return json_error("Missing username or message", 400)
+    user = get_user_by_username(username)
+    if not user:
+        return json_error("User not found", 404)
+    user = ensure_score(user)
+
+    local = LocalAnswerer.answer(user, message)
+    if local:
+        CHAT_SESSIONS.append((username, data.get("session_id") or "default"), message, local["response"])
+        return json_response({"status": "success", "response": local["response"], "source": "local", "intent": local["intent"]})
+
+    response = await ChatAgent.chat_async(user, message, data.get("session_id"))
+    return json_response({"status": "success", "response": response, "source": "llm"})
+
+@async_web_app.post('/set_goal')
+async def async_set_goal(req: ASGIRequest):
+    data = await request_json(req)
+    username = data.get("username")
+    goal = data.get("goal")
+    if not username or not goal:
+        return json_error("Missing username or goal", 400)
+    user = get_user_by_username(username)
+    if not user:
+        return json_error("User not found", 404)
+    if wants_job(data, req.query_params):
+        goal_amount = data.get("goal_amount", 0)
+        return json_response(*job_accepted(JOBS.submit("set_goal", username, lambda: set_user_goal(username, goal, goal_amount),
+                                                       key=goal_job_key(username, goal, goal_amount))))
+    user = ensure_score(user)
+
+    plan = await GoalSettingAgent.generate_goal_plan_async(user, goal)
+    store_goal(username, goal, data.get("goal_amount", 0), plan)
+    await asyncio.to_thread(save_user_data)
+    return json_response({"status": "success", "data": plan})
+
+@async_web_app.post('/generate_plan')
+async def async_generate_plan(req: ASGIRequest):
+    data = await request_json(req)
+    username = data.get("username")
+    user = get_user_by_username(username)
+    if not user:
+        return json_error("User not found", 404)
+    if wants_job(data, req.query_params):
+        return json_response(*job_accepted(JOBS.submit("generate_plan", username, lambda: generate_user_plans(username),
+                                                       key=(username, user.version, "generate_plan"))))
+
+    async def compute_plans():
+        return await FinancialPlanAgent.generate_plans_async(user, CreditCalculationAgent.calculate(user))
+
+    plans = await COALESCER.do_async((username, user.version, "generate_plan"), compute_plans)
+    return json_response({"status": "success", "data": plans})
+
+@async_web_app.post('/ingest')
+async def async_ingest(req: ASGIRequest):
+    # The body is read before queueing; enqueueing may block on backpressure, so it runs off the loop
+    body = await req.body()
+    if req.headers.get("content-type", "").split(";")[0].strip() in NDJSON_MIMETYPES:
+        records = ndjson_records(io.BytesIO(body))
+    else:
+        try:
+            data = json_loads(body)
+        except ValueError:
+            data = None
+        records = json_records(data)
+    payload, status = await asyncio.to_thread(submit_ingest_records, records, bool(req.query_params.get('wait')))
+    return json_response(payload, status)
+
+@async_web_app.post('/simulate')
+async def async_simulate(req: ASGIRequest):
+    payload, status = simulate_response(await request_json(req))
+    return json_response(payload, status)
+
+@async_web_app.get('/jobs/{job_id}')
+async def async_job_status(job_id: str):
+    return json_response(*job_response(job_id))
+
+@async_web_app.get('/metrics/llm')
+async def async_llm_metrics():
+    return json_response({"status": "success", "data": LLM_SCHEDULER.metrics()})
+
+@async_web_app.get('/cohort')
+async def async_cohort(req: ASGIRequest):
+    payload, status = cohort_response(req.query_params)
+    return json_response(payload, status)
+
+@async_web_app.get('/changes')
+async def async_changes(req: ASGIRequest):
+    username = req.query_params.get('user')
+    if not get_user_by_username(username):
+        return json_error("User not found", 404)
+    try:
+        seq, version = feed_cursor(req.query_params, req.headers)
+    except ValueError:
+        return json_error("Invalid resume position", 400)
+    return StreamingResponse(CHANGE_FEED.stream_async(username, seq, version), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@async_web_app.get('/users')
+async def async_users():
+    return json_response({"status": "success", "data": list_users()})
 
 # --- MODAL ENTRYPOINT ---
 @app.function(image=image)
 @modal.wsgi_app()
 def flask_app():
+    start_background_services()
     return web_app
 
+# Async serving mode: one container multiplexes many in-flight LLM waits
+@app.function(image=image)
+@modal.concurrent(max_inputs=500)
+@modal.asgi_app()
+def fastapi_app():
+    start_background_services()
+    return async_web_app
+
 if __name__ == '__main__':
-    # This allows running locally with `python backend.py`
-    web_app.run(host='0.0.0.0', port=5001, debug=True)
+    parser = argparse.ArgumentParser(description="LuminCredit backend")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("serve", help="run the Flask app locally (default)")
+    export = commands.add_parser("export", help="export users, transactions and scores as Parquet/Arrow files")
+    export.add_argument("--out", default="exports", help="output directory (default: exports)")
+    export.add_argument("--format", choices=("parquet", "arrow"), default="parquet")
+    export.add_argument("--full", action="store_true", help="export every user, not only those changed since the last run")
+    export.add_argument("--row-group-size", type=int, default=EXPORT_ROW_GROUP_SIZE)
+    report = commands.add_parser("score-report", help="score and explain every user into an NDJSON report")
+    report.add_argument("--out", default="score_report.ndjson", help="output file (default: score_report.ndjson)")
+    report.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    report.add_argument("--impacts", choices=("stub", "live", "cache"), default="stub",
+                        help="dynamic score impacts: default weights (stub), the LLM (live) or the LLM behind a cache")
+    report.add_argument("--impacts-cache", default=SCORE_REPORT_IMPACTS_CACHE)
+    report.add_argument("--chunk-size", type=int, default=SCORE_REPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(json.dumps(export_analytics(args.out, args.format, args.full, args.row_group_size), indent=2))
+    elif args.command == "score-report":
+        print(json.dumps(run_score_report(args.out, args.workers, args.impacts, args.impacts_cache, args.chunk_size), indent=2))
+    else:
+        # This allows running locally with `python backend.py`
+        # (only in the reloader's child process, so jobs are not run twice)
+        if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            start_background_services()
+        web_app.run(host='0.0.0.0', port=5001, debug=True)
@@ -0,0 +1,220 @@
+"""
+Benchmarks for the non-LLM paths of the backend.
+
+Runs against a temporary copy of backend/user_data.json with the LLM
+client disabled, so it never touches the real data or the Nebius API:
+
+    python bench.py            # all benchmarks
+    python bench.py ingest     # just one
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import shutil
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def load_backend():
+    # backend.py reads and writes backend/user_data.json relative to the cwd
+    workdir = tempfile.mkdtemp(prefix="lumin-bench-")
+    os.makedirs(os.path.join(workdir, "backend"))
+    shutil.copy(os.path.join(ROOT, "backend", "user_data.json"), os.path.join(workdir, "backend", "user_data.json"))
+    os.chdir(workdir)
+    os.environ["NEBIUS_API_KEY"] = "offline"
+    sys.path.insert(0, ROOT)
+    import backend
+
+    class OfflineCompletions:
+        def create(self, **kwargs):
+            raise RuntimeError("LLM disabled in benchmarks")
+
+    class OfflineClient:
+        def __init__(self, *args, **kwargs):
+            self.chat = type("Chat", (), {"completions": OfflineCompletions()})()
+
+    class OfflineAsyncCompletions:
+        async def create(self, **kwargs):
+            raise RuntimeError("LLM disabled in benchmarks")
+
+    class OfflineAsyncClient:
+        def __init__(self, *args, **kwargs):
+            self.chat = type("Chat", (), {"completions": OfflineAsyncCompletions()})()
+
+    backend.OpenAI = OfflineClient
+    backend.AsyncOpenAI = OfflineAsyncClient
+    return backend
+
+def simulated_llm(backend, latency):
+    """Swaps in LLM clients that just wait `latency` seconds, like a slow Nebius call."""
+    reply = lambda: type("Response", (), {"choices": [type("Choice", (), {
+        "message": type("Message", (), {"content": "Simulated reply."})()})()]})()
+
+    class SlowCompletions:
+        def create(self, **kwargs):
+            time.sleep(latency)
+            return reply()
+
+    class SlowAsyncCompletions:
+        async def create(self, **kwargs):
+            await asyncio.sleep(latency)
+            return reply()
+
+    backend.OpenAI = lambda *a, **k: type("Client", (), {"chat": type("Chat", (), {"completions": SlowCompletions()})()})()
+    backend.AsyncOpenAI = lambda *a, **k: type("Client", (), {"chat": type("Chat", (), {"completions": SlowAsyncCompletions()})()})()
+    backend._nebius_async_client = None
+
+def report(name, count, unit, elapsed):
+    print(f"{name:<40} {count:>8} {unit:<6} {elapsed * 1000:>10.1f} ms {count / elapsed:>12.0f} {unit}/s")
+
+def restore_users(backend, originals):
+    """Puts back the original users and rebuilds every per-user index from them."""
+    backend.USER_DATA.clear()
+    backend.USER_DATA.update(originals)
+    for username, user in originals.items():
+        backend.ALERT_ENGINE.index_user(username, user)
+        backend.MONTH_BUCKETS.index_user(username, user)
+        backend.COHORTS.update(username, user, backend.snapshot_score(user))
+
+def synthetic_transactions(usernames, count, seed=7):
+    rng = random.Random(seed)
+    types = ["Normal_Transaction", "EMI_Repayment", "CC_Full_Payment", "Large_Purchase", "Credit_Inquiry"]
+    statuses = ["Completed", "Paid on Time", "Paid on Time", "30 Days Late"]
+    for _ in range(count):
+        yield {
+            "username": rng.choice(usernames),
+            "date": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "type": rng.choice(types),
+            "amount": rng.randint(100, 80000),
+            "status": rng.choice(statuses)
+        }
+
+def bench_ingest(backend, total=50000, chunk=5000):
+    """Sustained NDJSON ingest throughput through /ingest, including batched persistence."""
+    client = backend.web_app.test_client()
+    usernames = list(backend.USER_DATA)
+    records = list(synthetic_transactions(usernames, total))
+    originals = dict(backend.USER_DATA)
+    start = time.perf_counter()
+    try:
+        for i in range(0, total, chunk):
+            body = "\n".join(json.dumps(r) for r in records[i:i + chunk])
+            wait = "?wait=1" if i + chunk >= total else ""
+            response = client.post(f"/ingest{wait}", data=body, content_type="application/x-ndjson")
+            assert response.status_code == 200, response.get_json()
+        report("ingest (NDJSON, end to end)", total, "tx", time.perf_counter() - start)
+    finally:
+        # Later benchmarks expect the original users and indexes, not 50k extra transactions
+        restore_users(backend, originals)
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return time.perf_counter() - start
+
+def bench_serialization(backend, scale=200, repeat=5):
+    """
+    Store encode/decode (stdlib indent=4 vs json_dumps/json_loads) on the
+    19-scenario data.json and on user_data scaled up `scale` times, plus
+    dashboard response encoding with and without pre-encoded sections.
+    """
+    print(f"(encoder: {'orjson' if backend.orjson else 'stdlib json'})")
+    with open(os.path.join(ROOT, "data.json"), "rb") as f:
+        scenarios = json.loads(f.read())
+    scaled = [dict(user, username=f"{user['username']}_{i}") for i in range(scale) for user in backend.USER_DATA.values()]
+
+    for label, users in ((f"{len(scenarios)}-scenario", scenarios), (f"scaled x{scale}", scaled)):
+        stdlib_bytes = json.dumps(users, indent=4).encode()
+        fast_bytes = backend.json_dumps(users)
+        report(f"save {label} stdlib indent=4", repeat, "runs", timed(lambda: json.dumps(users, indent=4), repeat))
+        report(f"save {label} json_dumps", repeat, "runs", timed(lambda: backend.json_dumps(users), repeat))
+        report(f"load {label} stdlib", repeat, "runs", timed(lambda: json.loads(stdlib_bytes), repeat))
+        report(f"load {label} json_loads", repeat, "runs", timed(lambda: backend.json_loads(fast_bytes), repeat))
+        print(f"{'':<40} size {len(stdlib_bytes) / 1024:.0f} KiB -> {len(fast_bytes) / 1024:.0f} KiB")
+
+    # A large user: every transaction of every user, times 20
+    username = "user01"
+    originals = dict(backend.USER_DATA)
+    transactions = [dict(tx) for _ in range(20) for u in list(backend.USER_DATA.values()) for tx in u["transactions"]]
+    user = backend.update_user(username, lambda draft: draft.update(transactions=transactions))
+    core_entry, freshness = backend.get_materialized_dashboard(username, user)
+    payload = backend.build_dashboard_response(username, user, core_entry, freshness)
+    label = f"dashboard ({len(user['transactions'])} tx)"
+    report(f"{label} stdlib json", repeat * 20, "resp", timed(lambda: json.dumps(payload), repeat * 20))
+    report(f"{label} json_dumps", repeat * 20, "resp", timed(lambda: backend.json_dumps(payload), repeat * 20))
+    report(f"{label} cached sections", repeat * 20, "resp", timed(lambda: backend.encode_dashboard_response(username, payload, core_entry), repeat * 20))
+    restore_users(backend, originals)
+
+def bench_serving(backend, requests=200, threads=16, latency=0.25):
+    """
+    Load test: `requests` concurrent open-ended /chat calls, each waiting on
+    a simulated `latency`-second LLM call. The WSGI path is capped by its
+    worker threads; the ASGI path awaits all calls on one event loop.
+    """
+    offline = backend.OpenAI, backend.AsyncOpenAI, backend.LLM_SCHEDULER
+    simulated_llm(backend, latency)
+    # The simulated LLM has no quota: measure serving, not the scheduler's limits
+    backend.LLM_SCHEDULER = backend.LLMScheduler(max_concurrency=requests, tokens_per_minute=10 ** 9)
+    try:
+        run_serving_load(backend, requests, threads)
+    finally:
+        backend.OpenAI, backend.AsyncOpenAI, backend.LLM_SCHEDULER = offline
+        backend._nebius_async_client = None
+
+def run_serving_load(backend, requests, threads):
+    from concurrent.futures import ThreadPoolExecutor
+    import httpx
+
+    body = {"username": "user01", "message": "Should I refinance my car loan?"}
+
+    client = backend.web_app.test_client()
+    def wsgi_call(i):
+        return client.post("/chat", json=dict(body, session_id=f"wsgi-{i}")).status_code
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(wsgi_call, range(requests)))
+    assert set(statuses) == {200}, statuses
+    report(f"serving WSGI ({threads} threads)", requests, "req", time.perf_counter() - start)
+
+    async def asgi_run():
+        transport = httpx.ASGITransport(app=backend.async_web_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            calls = [http.post("/chat", json=dict(body, session_id=f"asgi-{i}")) for i in range(requests)]
+            return [r.status_code for r in await asyncio.gather(*calls)]
+    start = time.perf_counter()
+    statuses = asyncio.run(asgi_run())
+    assert set(statuses) == {200}, statuses
+    report("serving ASGI (1 event loop)", requests, "req", time.perf_counter() - start)
+
+def bench_score_report(backend, scale=400):
+    """Bulk score report over the users replicated `scale` times, in-process and across all cores."""
+    originals = dict(backend.USER_DATA)
+    for i in range(scale):
+        for username, user in originals.items():
+            name = f"{username}_{i}"
+            backend.USER_DATA[name] = backend.UserSnapshot(dict(user, username=name))
+    total = len(backend.USER_DATA)
+    try:
+        for workers in sorted({1, os.cpu_count() or 1}):
+            start = time.perf_counter()
+            backend.run_score_report("score_report.ndjson", workers=workers, progress=None)
+            report(f"score report ({workers} worker{'s' if workers > 1 else ''})", total, "users", time.perf_counter() - start)
+    finally:
+        restore_users(backend, originals)
+
+BENCHMARKS = {
+    "ingest": bench_ingest,
+    "serialization": bench_serialization,
+    "score_report": bench_score_report,
+    "serving": bench_serving
+}
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    backend = load_backend()
+    for name in selected:
+        BENCHMARKS[name](backend)